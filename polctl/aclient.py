@@ -0,0 +1,242 @@
+import json
+import time
+import random
+import asyncio
+import logging
+import itertools
+import numpy as np
+from polctl.protocol import PROTO_JSON
+from polctl.constants import (
+    CMD,
+    SERVER_HOST,
+    SERVER_PORT,
+    CLIENT_POOL_SIZE,
+    CLIENT_TIMEOUT,
+    CLIENT_CONNECT_TIMEOUT,
+    CLIENT_RETRIES,
+    CLIENT_BACKOFF,
+    CLIENT_BACKOFF_MAX
+)
+
+log = logging.getLogger(__name__)
+
+# Commands that may be sent again after a lost connection
+IDEMPOTENT_CMDS = (CMD.GET, CMD.TFORM, CMD.MEAS)
+
+
+class CommandError(Exception):
+    # An ERR reply from the server, code is e.g. NOT_SET or NO_ARGS
+    def __init__(self, cmd, code):
+        super().__init__(f"{cmd}: {code}")
+        self.cmd = cmd
+        self.code = code
+
+
+def _typed(value):
+    # vectors come back as lists
+    if isinstance(value, list):
+        return np.array(value, dtype=float)
+    return value
+
+
+class Response(object):
+    __slots__ = ["cmd", "value", "fields", "latency"]
+
+    def __init__(self, cmd, value, fields, latency):
+        self.cmd = cmd
+        self.value = value
+        self.fields = fields
+        self.latency = latency
+
+    def __getattr__(self, name):
+        try:
+            return self.fields[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __repr__(self):
+        return f"Response({self.cmd}, {self.value}, {self.fields})"
+
+
+class Connection(object):
+    # One persistent connection in JSON mode. Requests are pipelined and
+    # replies matched to them by id, so they may complete out of order.
+    def __init__(self, host, port, timeout=CLIENT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._task = None
+        self._pending = dict()
+        self._ids = itertools.count(1)
+
+    @property
+    def connected(self):
+        return self._task is not None and not self._task.done()
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), CLIENT_CONNECT_TIMEOUT)
+        self._writer.write(f"{CMD.PROTO} {PROTO_JSON}\n".encode())
+        await self._writer.drain()
+        line = await asyncio.wait_for(self._reader.readline(), CLIENT_CONNECT_TIMEOUT)
+        if not line.startswith(b"OK"):
+            self._writer.close()
+            raise ConnectionError(f"Protocol switch refused: {line!r}")
+        self._task = asyncio.create_task(self._read_replies())
+
+    async def _read_replies(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                msg = json.loads(line)
+                fut = self._pending.pop(msg.get("id"), None)
+                if fut is not None and not fut.done():
+                    fut.set_result(msg)
+        except Exception as e:
+            log.error(f"Connection to {self.host}:{self.port} failed: {e}")
+        finally:
+            self._fail(ConnectionError("Connection closed"))
+
+    def _fail(self, exc):
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(exc)
+        self._pending.clear()
+
+    async def request(self, cmd, args=None, link=None, timeout=None):
+        if not self.connected:
+            raise ConnectionError("Not connected")
+        req_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = fut
+        req = {"id": req_id, "cmd": cmd, "args": [str(a) for a in args or []]}
+        if link is not None:
+            req["link"] = link
+        start = time.perf_counter()
+        try:
+            self._writer.write((json.dumps(req) + "\n").encode())
+            await self._writer.drain()
+            msg = await asyncio.wait_for(fut, timeout or self.timeout)
+        finally:
+            self._pending.pop(req_id, None)
+        latency = time.perf_counter() - start
+        if not msg.get("ok"):
+            raise CommandError(cmd, msg.get("error"))
+        fields = {k: _typed(v) for k, v in msg.items() if k not in ("id", "ok", "result")}
+        return Response(cmd, _typed(msg.get("result")), fields, latency)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+        self._fail(ConnectionError("Connection closed"))
+
+
+class PolClient(object):
+    # Pool of persistent connections to a pol_ctl server. Each request goes
+    # to the least busy connection, lost connections are reopened with
+    # exponential backoff and idempotent requests are retried.
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, size=CLIENT_POOL_SIZE,
+                 timeout=CLIENT_TIMEOUT, retries=CLIENT_RETRIES, link=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.link = link
+        self._pool = [Connection(host, port, timeout) for i in range(size)]
+        self._locks = [asyncio.Lock() for c in self._pool]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _connected(self, i):
+        conn = self._pool[i]
+        async with self._locks[i]:
+            delay = CLIENT_BACKOFF
+            for attempt in range(self.retries):
+                if conn.connected:
+                    return conn
+                try:
+                    await conn.connect()
+                    return conn
+                except (OSError, asyncio.TimeoutError) as e:
+                    log.warning(f"Connect to {self.host}:{self.port} failed: {e}, "
+                                f"retrying in {delay:.2f}s")
+                    await asyncio.sleep(delay*(1 + random.random()))
+                    delay = min(2*delay, CLIENT_BACKOFF_MAX)
+            raise ConnectionError(f"Could not connect to {self.host}:{self.port}")
+
+    async def request(self, cmd, *args, link=None, timeout=None):
+        link = self.link if link is None else link
+        tries = self.retries if cmd in IDEMPOTENT_CMDS else 1
+        for attempt in range(tries):
+            i = min(range(len(self._pool)),
+                    key=lambda j: (not self._pool[j].connected, len(self._pool[j])))
+            conn = await self._connected(i)
+            try:
+                return await conn.request(cmd, args, link, timeout)
+            except ConnectionError:
+                if attempt == tries - 1:
+                    raise
+
+    # Typed command helpers, target is S1,S2,S3 as a string or sequence,
+    # or C / T for the saved capture / transform
+    @staticmethod
+    def _target(target):
+        if isinstance(target, str):
+            return target
+        return ",".join(str(float(x)) for x in target)
+
+    @staticmethod
+    def _opts(opts):
+        return [f"{k}={v}" for k, v in opts.items()]
+
+    async def measure(self, target=None, **kw):
+        # fidelity to target and the Stokes vector
+        args = [] if target is None else [self._target(target)]
+        r = await self.request(CMD.MEAS, *args, **kw)
+        return r.value, r.stokes
+
+    async def capture(self, samples=None, **kw):
+        args = [] if samples is None else [samples]
+        return (await self.request(CMD.CAPTURE, *args, **kw)).value
+
+    async def transform(self, theta, **kw):
+        return (await self.request(CMD.TFORM, theta, **kw)).value
+
+    async def get(self, what="SOP", **kw):
+        return (await self.request(CMD.GET, what, **kw)).value
+
+    async def set(self, target, fidelity=None, link=None, timeout=None, **opts):
+        args = [self._target(target)] + ([] if fidelity is None else [fidelity])
+        return await self.request(CMD.SET, *args, *self._opts(opts), link=link,
+                                  timeout=timeout)
+
+    async def maintain(self, target, fidelity=None, link=None, timeout=None, **opts):
+        args = [self._target(target)] + ([] if fidelity is None else [fidelity])
+        return await self.request(CMD.MAINTAIN, *args, *self._opts(opts), link=link,
+                                  timeout=timeout)
+
+    async def abort(self, link=None):
+        # stops running and queued calibrations and the maintain mode,
+        # returns how many were stopped
+        return (await self.request(CMD.ABORT, link=link)).value
+
+    async def close(self):
+        for conn in self._pool:
+            await conn.close()
@@ -0,0 +1,54 @@
+from polctl.pax1000 import PAX1000
+from polctl.ozoptics import EPCDriver
+from polctl.constants import (
+    EPC_PORT,
+    PAX_RESOURCE
+)
+
+
+# Each backend returns an (EPCDriver, PAX1000) pair. The drivers are the same
+# for every backend, only the serial port and VISA resource underneath change.
+# With a trace path, every EPC write and polarimeter record is also appended
+# to that file for the replay backend.
+def _tap(ser, inst, trace):
+    if not trace or ser is None:
+        return ser, inst
+    from polctl.replay import TraceRecorder, SerialTap, InstrumentTap
+    recorder = TraceRecorder(trace)
+    return SerialTap(ser, recorder), InstrumentTap(inst, recorder)
+
+
+def open_hw(port=EPC_PORT, device=PAX_RESOURCE, trace=None):
+    if not trace:
+        return EPCDriver(port=port), PAX1000(device=device)
+    ser, inst = _tap(EPCDriver._open(port, 9600), PAX1000._open(device), trace)
+    return EPCDriver(port=port, ser=ser), PAX1000(device=device, inst=inst)
+
+
+def open_sim(trace=None, **kwargs):
+    from polctl.sim import SimBench
+    bench = SimBench(**kwargs)
+    ser, inst = _tap(bench.serial(), bench.instrument(), trace)
+    return EPCDriver(ser=ser), PAX1000(inst=inst)
+
+
+def open_replay(path, trace=None, **kwargs):
+    from polctl.replay import ReplayBench
+    bench = ReplayBench(path, **kwargs)
+    ser, inst = _tap(bench.serial(), bench.instrument(), trace)
+    return EPCDriver(ser=ser), PAX1000(inst=inst)
+
+
+BACKENDS = {
+    "hw": open_hw,
+    "sim": open_sim,
+    "replay": open_replay,
+}
+
+
+def open_devices(backend="hw", **kwargs):
+    try:
+        opener = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown device backend: {backend}")
+    return opener(**kwargs)
@@ -0,0 +1,293 @@
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import logging
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from polctl import constants
+from polctl.sim import SimBench
+from polctl.ozoptics import EPCDriver
+from polctl.pax1000 import PAX1000
+from polctl.pol_ctl import PolarizationControl
+from polctl.constants import (
+    CMD,
+    BENCH_EPISODES,
+    BENCH_FIDELITY,
+    BENCH_DRIFT_MAX,
+    BENCH_RATE_MAX,
+    BENCH_MAINTAIN_TIME,
+    BENCH_SAMPLE,
+    BENCH_MAX_BELOW,
+    BENCH_MIN_EPISODES,
+    BENCH_BOOTSTRAP,
+    BENCH_CONFIDENCE,
+    DEF_OPTIMIZER
+)
+
+log = logging.getLogger(__name__)
+
+# Constants a parameter set may override, besides the optimizer "opt"
+TUNABLE = ("LEARNING_RATE", "STEP", "DEF_GA_RAND_THRESH", "DEF_GA_RAND_ITERS",
+           "DEF_GA_ITERATIONS", "EPC_SLEEP_TIME", "SETTLE_TOL", "JACOBIAN_PROBE",
+           "KALMAN_DEADBAND")
+# their values before any override, a worker runs episodes of every set
+_DEFAULTS = {k: getattr(constants, k) for k in TUNABLE}
+
+
+# Parameter set NAME=VALUE[,NAME=VALUE...]
+def parse_set(spec):
+    params = dict()
+    for item in filter(None, spec.split(",")):
+        k, _, v = item.partition("=")
+        if k == "opt":
+            params[k] = v
+        elif k in TUNABLE:
+            params[k] = type(getattr(constants, k))(float(v))
+        else:
+            raise argparse.ArgumentTypeError(f"{k} is not tunable, one of {TUNABLE} or opt")
+    return params
+
+
+# Grid NAME=V1:V2:... expands to one parameter set per value
+def parse_grid(spec):
+    k, _, values = spec.partition("=")
+    return [parse_set(f"{k}={v}") for v in values.split(":")]
+
+
+def _apply(params):
+    # Constants are imported by value, so override them in every module of
+    # the (worker) process that uses them
+    for k, v in dict(_DEFAULTS, **params).items():
+        if k == "opt":
+            continue
+        for name, mod in list(sys.modules.items()):
+            if name.split(".")[0] == "polctl" and hasattr(mod, k):
+                setattr(mod, k, v)
+
+
+def _uniform_sphere(rng):
+    v = rng.normal(size=3)
+    return v / np.linalg.norm(v)
+
+
+async def _episode(spec):
+    params = spec["params"]
+    rng = np.random.default_rng(spec["seed"])
+    np.random.seed(spec["seed"] % 2**32)
+    drift = rng.uniform(0, spec["drift_max"])
+    rate = rng.uniform(0, spec["rate_max"])
+    target = _uniform_sphere(rng)
+    kw = {"latency": 0} if spec["fast"] else {}
+    bench = SimBench(drift=drift, rate=rate, seed=int(rng.integers(2**31)), **kw)
+    epc, pax = EPCDriver(ser=bench.serial()), PAX1000(inst=bench.instrument())
+    pc = PolarizationControl(epc=epc, pax=pax, name=str(spec["id"]),
+                             interval=spec["interval"])
+    pc.rng = rng
+    # bound as defaults of the settle engine, the parameter set may
+    # override them
+    pc.settle.max_wait = constants.EPC_SLEEP_TIME
+    pc.settle.tol = constants.SETTLE_TOL
+    res = {"id": spec["id"], "kind": spec["kind"], "seed": spec["seed"],
+           "drift": drift, "rate": rate}
+    opt = params.get("opt", DEF_OPTIMIZER)
+    threshold = 1 - spec["fidelity"]
+    start = time.monotonic()
+    try:
+        if spec["kind"] == "set":
+            pc._evals = 0
+            p, f, n = await pc.gradient_ascent(target_states=[target],
+                                               max_iterations=constants.DEF_GA_ITERATIONS,
+                                               threshold=threshold, optimizer=opt)
+            res.update(f=float(f[-1]), iters=int(n - 1), evals=pc._evals,
+                       evals_to_fidelity=pc._evals_to_fidelity,
+                       converged=pc._evals_to_fidelity is not None)
+        else:
+            # calibrate, then maintain while sampling the true fidelity
+            loop = asyncio.create_task(pc._loop())
+            targ = ",".join(str(x) for x in target)
+            await pc.submit(CMD.SET, [targ, str(spec["fidelity"]), f"opt={opt}"])
+            await pc.submit(CMD.MAINTAIN, [targ, str(spec["fidelity"]), f"opt={opt}"])
+            f = list()
+            t0 = time.monotonic()
+            while time.monotonic() - t0 < spec["duration"]:
+                f.append(float(bench.sop() @ target))
+                await asyncio.sleep(BENCH_SAMPLE)
+            loop.cancel()
+            f = np.array(f)
+            below = float((f < spec["fidelity"]).mean())
+            res.update(f=float(f.mean()), f_min=float(f.min()), below=below,
+                       converged=below <= BENCH_MAX_BELOW)
+    except Exception as e:
+        res.update(converged=False, error=str(e))
+    res["wall"] = time.monotonic() - start
+    pc.epc_io.close()
+    pc.pax_io.close()
+    return res
+
+
+def run_episode(spec):
+    logging.disable(logging.INFO)
+    _apply(spec["params"])
+    return asyncio.run(_episode(spec))
+
+
+def _stats(x):
+    x = np.array([v for v in x if v is not None], dtype=float)
+    if not len(x):
+        return None
+    return {"mean": float(x.mean()), "p10": float(np.percentile(x, 10)),
+            "p50": float(np.percentile(x, 50)), "p90": float(np.percentile(x, 90)),
+            "max": float(x.max())}
+
+
+def summarize(episodes):
+    n = len(episodes)
+    s = {"episodes": n,
+         "failure_rate": sum(not e["converged"] for e in episodes) / n if n else None,
+         "wall": _stats(e["wall"] for e in episodes),
+         "f": _stats(e.get("f") for e in episodes)}
+    if episodes and episodes[0]["kind"] == "set":
+        s["evals"] = _stats(e.get("evals") for e in episodes)
+        s["evals_to_fidelity"] = _stats(e.get("evals_to_fidelity") for e in episodes)
+        s["iters"] = _stats(e.get("iters") for e in episodes)
+    else:
+        s["below"] = _stats(e.get("below") for e in episodes)
+        s["f_min"] = _stats(e.get("f_min") for e in episodes)
+    return s
+
+
+def _relative(cur, base):
+    # relative change, any increase from zero counts as infinite
+    safe = np.where(base > 0, base, 1)
+    return np.where(base > 0, (cur - base)/safe, np.where(cur > base, np.inf, 0.0))
+
+
+# Per metric: the episode values, the statistic and how a change of the
+# statistic is measured against the tolerance
+_COMPARED = (
+    ("failure_rate", lambda e: float(not e["converged"]), np.mean, np.subtract),
+    ("evals_to_fidelity", lambda e: e.get("evals_to_fidelity"), np.median, _relative),
+    ("below", lambda e: e.get("below"), np.mean, _relative),
+)
+
+
+def _lower_bound(cur, base, stat, change, rng):
+    # One-sided BENCH_CONFIDENCE lower bound of the change of stat from
+    # base to cur, by bootstrap resampling of both
+    c = stat(rng.choice(cur, (BENCH_BOOTSTRAP, len(cur))), axis=1)
+    b = stat(rng.choice(base, (BENCH_BOOTSTRAP, len(base))), axis=1)
+    return float(np.percentile(change(c, b), 100*(1 - BENCH_CONFIDENCE)))
+
+
+def compare(result, baseline, tolerance, seed=0):
+    # Regressions of each parameter set against the baseline result with
+    # the same parameters: with BENCH_CONFIDENCE, a failure rate higher by
+    # more than tolerance, or a median evaluations to fidelity / mean time
+    # below fidelity more than tolerance (relative) worse. Sets with fewer
+    # than BENCH_MIN_EPISODES episodes on either side are not compared.
+    rng = np.random.default_rng(seed)
+    base = {json.dumps(s["params"], sort_keys=True): s["episodes"] for s in baseline["sets"]}
+    regressions = list()
+    for s in result["sets"]:
+        b = base.get(json.dumps(s["params"], sort_keys=True))
+        if b is None:
+            continue
+        if min(len(b), len(s["episodes"])) < BENCH_MIN_EPISODES:
+            log.warning(f"{json.dumps(s['params'])}: fewer than {BENCH_MIN_EPISODES} "
+                        "episodes, not compared")
+            continue
+        for key, value, stat, change in _COMPARED:
+            x = np.array([v for v in map(value, s["episodes"]) if v is not None], dtype=float)
+            y = np.array([v for v in map(value, b) if v is not None], dtype=float)
+            if not len(x) or not len(y):
+                continue
+            if _lower_bound(x, y, stat, change, rng) > tolerance:
+                regressions.append((s["params"], key, float(stat(y)), float(stat(x))))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Monte Carlo calibration and maintain episodes against the simulated bench")
+    parser.add_argument("-n", "--episodes", type=int, default=BENCH_EPISODES,
+                        help="episodes per parameter set")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes")
+    parser.add_argument("--kind", choices=("set", "maintain"), default="set")
+    parser.add_argument("--set", dest="sets", action="append", type=parse_set, default=None,
+                        help="parameter set NAME=VALUE[,NAME=VALUE...], may be repeated, "
+                             f"NAME is opt or one of {', '.join(TUNABLE)}")
+    parser.add_argument("--grid", action="append", type=parse_grid, default=None,
+                        help="NAME=V1:V2:..., the product of all grids is run")
+    parser.add_argument("--fidelity", type=float, default=BENCH_FIDELITY)
+    parser.add_argument("--drift-max", type=float, default=BENCH_DRIFT_MAX,
+                        help="episode fiber random walk is uniform up to this, rad/sqrt(s)")
+    parser.add_argument("--rate-max", type=float, default=BENCH_RATE_MAX,
+                        help="episode fiber rotation rate is uniform up to this, rad/s")
+    parser.add_argument("--duration", type=float, default=BENCH_MAINTAIN_TIME,
+                        help="seconds of maintain per episode")
+    parser.add_argument("--interval", type=float, default=0.2,
+                        help="control loop interval of maintain episodes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fast", action="store_true",
+                        help="no simulated polarimeter query latency")
+    parser.add_argument("-o", "--output", default="bench.json")
+    parser.add_argument("--compare", default=None, help="baseline result file")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="allowed regression against the baseline, absolute for the "
+                             "failure rate, else relative")
+    args = parser.parse_args()
+    baseline = None
+    if args.compare:
+        if os.path.abspath(args.compare) == os.path.abspath(args.output):
+            parser.error("--output would overwrite the --compare baseline")
+        if args.episodes < BENCH_MIN_EPISODES:
+            parser.error(f"--compare needs at least {BENCH_MIN_EPISODES} episodes per set")
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+    sets = list(args.sets or [])
+    if args.grid:
+        for combo in itertools.product(*args.grid):
+            sets.append({k: v for p in combo for k, v in p.items()})
+    if not sets:
+        sets = [dict()]
+    specs = [{"id": i, "set": si, "params": params, "kind": args.kind,
+              "seed": args.seed + i, "fidelity": args.fidelity,
+              "drift_max": args.drift_max, "rate_max": args.rate_max,
+              "duration": args.duration, "interval": args.interval, "fast": args.fast}
+             for si, params in enumerate(sets) for i in range(args.episodes)]
+    start = time.time()
+    episodes = [list() for s in sets]
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        for spec, res in zip(specs, pool.map(run_episode, specs)):
+            episodes[spec["set"]].append(res)
+            done = sum(map(len, episodes))
+            print(f"\r{done}/{len(specs)} episodes", end="", file=sys.stderr, flush=True)
+    print(file=sys.stderr)
+    result = {"meta": {"kind": args.kind, "episodes": args.episodes, "seed": args.seed,
+                       "fidelity": args.fidelity, "drift_max": args.drift_max,
+                       "rate_max": args.rate_max, "fast": args.fast,
+                       "started": start, "elapsed": time.time() - start},
+              "sets": [{"params": params, "summary": summarize(eps), "episodes": eps}
+                       for params, eps in zip(sets, episodes)]}
+    with open(args.output, "w") as fh:
+        json.dump(result, fh, indent=1)
+    for s in result["sets"]:
+        sm = s["summary"]
+        key = "evals_to_fidelity" if args.kind == "set" else "below"
+        med = sm.get(key) and sm[key]["p50"]
+        print(f"{json.dumps(s['params'])}: failure rate {sm['failure_rate']:.3f}, "
+              f"median {key} {med}, median wall {sm['wall']['p50']:.2f}s")
+    if baseline is not None:
+        regressions = compare(result, baseline, args.tolerance, args.seed)
+        for params, key, old, new in regressions:
+            print(f"REGRESSION {json.dumps(params)} {key}: {old} -> {new}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import numpy as np
+from polctl.constants import CAP_CONF_Z
+
+
+class StokesStats(object):
+    # Weighted online (Welford/West) mean and covariance of Stokes vectors.
+    # Samples are weighted by their DOP, so poorly polarized readings
+    # count less.
+    def __init__(self, z=CAP_CONF_Z):
+        self.z = z
+        self.n = 0
+        self.W = 0.0
+        self.W2 = 0.0
+        self._mean = np.zeros(3)
+        self._C = np.zeros((3, 3))
+
+    def add(self, s, w=1.0):
+        if w <= 0:
+            return
+        s = np.asarray(s, dtype=float)
+        self.n += 1
+        self.W += w
+        self.W2 += w*w
+        delta = s - self._mean
+        self._mean += (w/self.W)*delta
+        self._C += w*np.outer(delta, s - self._mean)
+
+    @property
+    def mean(self):
+        # mean SOP, renormalized onto the sphere
+        n = np.linalg.norm(self._mean)
+        return self._mean / n if n else self._mean.copy()
+
+    @property
+    def n_eff(self):
+        return self.W*self.W/self.W2 if self.W2 else 0.0
+
+    @property
+    def cov(self):
+        # reliability weighted sample covariance
+        denom = self.W - self.W2/self.W if self.W else 0.0
+        return self._C/denom if denom > 0 else np.zeros((3, 3))
+
+    @property
+    def spread(self):
+        # RMS distance of the samples from their mean
+        return float(np.sqrt(max(0.0, np.trace(self.cov))))
+
+    @property
+    def radius(self):
+        # confidence radius of the mean
+        if self.n < 2:
+            return float("inf")
+        return float(self.z*np.sqrt(max(0.0, np.trace(self.cov))/self.n_eff))
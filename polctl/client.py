@@ -1,42 +1,59 @@
 import asyncio
+import argparse
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from polctl.aclient import PolClient, CommandError
+from polctl.constants import (
+    SERVER_HOST,
+    SERVER_PORT
+)
 
 CAPTURE = "C 10"
 SET = "S C 0.999"
 GET = "G SOP"
 
 
-async def tcp_pol_client(msg):
-    reader, writer = await asyncio.open_connection(
-        '127.0.0.1', 6000)
-
+async def tcp_pol_client(client, msg):
     print(f'Sending: {msg}')
-    writer.write(msg.encode())
-    await writer.drain()
-    data = await reader.read(1024)
-    print(f'Received: {data.decode()!r}')
-    writer.close()
-    await writer.wait_closed()
+    cmd = msg.split()
+    try:
+        r = await client.request(cmd[0], *cmd[1:])
+        print(f'Received: {r.value} {r.fields} ({r.latency*1e3:.1f} ms)')
+    except (CommandError, ConnectionError, asyncio.TimeoutError) as e:
+        print(f'Failed: {e}')
+
+
+async def calibrate_job(client):
+    await tcp_pol_client(client, SET)
+
 
+async def get_sop_job(client):
+    await tcp_pol_client(client, GET)
 
-async def calibrate_job():
-    await tcp_pol_client(SET)
 
+async def run(host, port, get_interval, set_interval):
+    async with PolClient(host, port) as client:
+        await tcp_pol_client(client, CAPTURE)
+        scheduler = AsyncIOScheduler()
+        scheduler.add_job(get_sop_job, 'interval', seconds=get_interval, args=[client])
+        if set_interval:
+            scheduler.add_job(calibrate_job, 'interval', seconds=set_interval, args=[client])
+        scheduler.start()
+        await asyncio.Event().wait()
 
-async def get_sop_job():
-    await tcp_pol_client(GET)
 
-scheduler = AsyncIOScheduler()
-scheduler.add_job(get_sop_job, 'interval', seconds=10)
-scheduler.add_job(calibrate_job, 'interval', minutes=1)
+def main():
+    parser = argparse.ArgumentParser(description="Periodic SOP readout and calibration")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--get-interval", type=float, default=10, help="seconds")
+    parser.add_argument("--set-interval", type=float, default=60,
+                        help="seconds, 0 leaves recalibration to the server (pol_ctl --recal)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args.host, args.port, args.get_interval, args.set_interval))
+    except (KeyboardInterrupt, SystemExit):
+        pass
 
-try:
 
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(tcp_pol_client(CAPTURE))
-    # time.sleep(240)
-    # loop.run_until_complete(tcp_pol_client(SET))
-    scheduler.start()
-    loop.run_forever()
-except (KeyboardInterrupt, SystemExit):
-    pass
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import heapq
+import asyncio
+import itertools
+from polctl.constants import CMD_PRIORITY, PRIO_DEFAULT
+
+
+def priority(cmd):
+    return CMD_PRIORITY.get(cmd, PRIO_DEFAULT)
+
+
+class Preempted(BaseException):
+    # Raised at the next evaluation of a calibration that a more urgent
+    # command has preempted. Like asyncio.CancelledError it is not an
+    # Exception, so the handlers' error replies do not swallow it.
+    pass
+
+
+class CommandQueue(object):
+    # Command queue of a control loop. Commands are served by priority
+    # (abort, then set/maintain, then the rest) and in order within one
+    # priority. A command queued again with the same arguments before it
+    # is served joins the queued entry, every submitter gets its reply.
+    def __init__(self):
+        self._heap = list()
+        self._entries = dict()
+        self._seq = itertools.count()
+        self._cond = asyncio.Condition()
+
+    def qsize(self):
+        return len(self._heap)
+
+    def empty(self):
+        return not self._heap
+
+    @staticmethod
+    def _key(cmd, args):
+        return cmd, tuple(args or ())
+
+    async def put(self, cmd, args, reply):
+        key = self._key(cmd, args)
+        async with self._cond:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["replies"].append(reply)
+                return
+            entry = {"cmd": cmd, "args": args, "replies": [reply]}
+            self._entries[key] = entry
+            heapq.heappush(self._heap, (priority(cmd), next(self._seq), key))
+            self._cond.notify_all()
+
+    async def get(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._heap)
+            _, _, key = heapq.heappop(self._heap)
+            return self._entries.pop(key)
+
+    def pending(self, prio):
+        # Whether a command of priority prio or more urgent is queued
+        return bool(self._heap) and self._heap[0][0] <= prio
+
+    async def wait(self, prio):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.pending(prio))
+
+    def _remove(self, keys):
+        entries = [self._entries.pop(k) for k in keys]
+        self._heap = [e for e in self._heap if e[2] in self._entries]
+        heapq.heapify(self._heap)
+        return entries
+
+    def take(self, cmd, args):
+        # Removes a queued duplicate of cmd and returns its reply futures
+        key = self._key(cmd, args)
+        if key not in self._entries:
+            return []
+        return self._remove([key])[0]["replies"]
+
+    def drop(self, cmds):
+        # Removes all queued commands in cmds and returns their entries
+        return self._remove([k for k in self._entries if k[0] in cmds])
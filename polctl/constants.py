@@ -4,13 +4,86 @@ WAVELENGTH = 1550e-9
 STEP = 50  # min voltage resolution of EPC
 LEARNING_RATE = 100
 NCHAN = 4
-EPC_SLEEP_TIME = 0.4  # seconds
+EPC_SLEEP_TIME = 0.4  # seconds, upper bound on EPC settle time
+SETTLE_TOL = 0.02  # max Stokes vector change between settled readings
+SETTLE_NSTABLE = 2  # consecutive agreeing readings to consider the SOP settled
+SETTLE_POLL = 0.01  # seconds between polarimeter polls while settling
+SETTLE_MIN = 0.03  # seconds, dead time before the first poll (serial transfer)
+SETTLE_ALPHA = 0.2  # learning rate of the settle time model
+SETTLE_PREDICT_FRAC = 0.8  # fraction of the predicted settle time slept without polling
+EPC_VMAX = 5000  # EPC channel voltage range is +/- EPC_VMAX
+EPC_PORT = "/dev/ttyUSB1"
+EPC_MAX_PENDING = 1024  # max EPC commands awaiting a response
+EPC_QUERY_TIMEOUT = 1.0  # seconds of silence ending a query response
+PAX_RESOURCE = "USB0::4883::32817::M00937524::0::INSTR"
+PAX_IDN = "THORLABS,PAX1000IR2,M00937524,1.0.13"
+PAX_MODEL = "THORLABS,PAX1000IR2"
+PAX_SNAPSHOT_TTL = 0.05  # seconds a polarimeter measurement is shared between readers
 DEF_CAP_SAMPLES = 10
-DEF_CAP_SAMPLE_SLEEP = 0.5
+CAP_MIN_SAMPLES = 3  # before a capture may stop early
+CAP_CONF_Z = 1.96  # confidence radius of a capture in standard errors
+CAP_POLL = 0.005  # seconds between polarimeter queries while capturing
+CAP_TIMEOUT = 1.0  # seconds without a new polarimeter dataset before a capture fails
 DEF_GA_FIDELITY = 0.999
 DEF_GA_ITERATIONS = 200
 DEF_GA_RAND_THRESH = 0.75
-DEF_GA_RAND_ITERS = 20
+DEF_GA_RAND_ITERS = 20  # budget of the quasi-random seed sweep
+SEED_RANGE = 4950  # seed sweep covers +/- SEED_RANGE on each channel
+DEF_OPTIMIZER = "gradient"
+HISTORY_CAPACITY = 4096  # rows of evaluation history kept in memory
+HISTORY_FLUSH = 64  # rows between flushes of the history file
+TRACE_FLUSH = 64  # records between flushes of a hardware trace file
+REPLAY_WINDOW = 30.0  # seconds of trace time around the replay time to interpolate from
+REPLAY_K = 4  # recorded samples interpolated per replayed measurement
+
+# Warm start index of converged solutions
+WARMSTART_CAPACITY = 64  # max stored solutions
+WARMSTART_MAX_AGE = 3600  # seconds before a stored solution is evicted
+WARMSTART_MAX_DIST = 0.5  # radians on the Poincare sphere for a usable neighbour
+WARMSTART_MERGE_DIST = 0.01  # radians, a new solution replaces older ones this close
+WARMSTART_K = 2  # stored solutions tried before the random search
+
+# Jacobian model of d(Stokes)/d(voltage) for one-shot drift correction
+JACOBIAN_REACH = 1000  # max voltage step (norm) used for model updates
+JACOBIAN_MAX_STEP = 500  # max voltage step (norm) of a computed correction
+JACOBIAN_FORGET = 0.95  # decay of the explored direction information per update
+JACOBIAN_MIN_INFO = 0.2  # min information in every direction before steps are trusted
+JACOBIAN_STEPS = 2  # computed steps to try before falling back to GA
+JACOBIAN_PROBE = 200  # voltage of a probe step along an unexplored direction
+
+# SPSA gains, a_k = SPSA_A/(k+1+SPSA_STABILITY)^SPSA_ALPHA, c_k = SPSA_C/(k+1)^SPSA_GAMMA
+SPSA_A = 2.0e5
+SPSA_C = 200
+SPSA_ALPHA = 0.602
+SPSA_GAMMA = 0.101
+SPSA_STABILITY = 5
+# Pattern search initial step and decay after a sweep without improvement
+PATTERN_STEP = 400
+PATTERN_DECAY = 0.5
+
+# Drift filter of the maintain mode
+KALMAN_Q = 1e-4  # SOP acceleration noise, (1/s^2)^2 s
+KALMAN_R = 1e-4  # Stokes measurement variance
+KALMAN_GATE = 16.3  # normalized innovation outlier level, chi-square 3 dof at 99.9%
+KALMAN_ESCALATE = 3  # consecutive outliers before falling back to calibration
+KALMAN_DEADBAND = 0.25  # correct once the predicted infidelity exceeds this part of the margin
+
+# Adaptive recalibration scheduler
+SCHED_MIN = 10.0  # seconds, shortest check interval
+SCHED_MAX = 600.0  # seconds, longest check interval
+SCHED_SAFETY = 0.5  # next check after this part of the predicted time left
+SCHED_SAMPLES = 5  # idle measurements per check interval
+SCHED_MIN_UPDATES = 3  # measurements at fixed voltages before the drift is trusted
+SCHED_GRID = 200  # prediction time steps up to the horizon, log spaced
+SCHED_Q = 1e-6  # drift filter acceleration noise, slow fiber drift
+
+# Simulated bench defaults
+SIM_EPC_VPI = 2500  # voltage for a pi retardance on one waveplate
+SIM_EPC_TAU = 0.05  # seconds, EPC response time constant
+SIM_PAX_REV_RATE = 100  # polarimeter waveplate revolutions per second
+SIM_PAX_LATENCY = 0.005  # seconds per VISA query
+SIM_PAX_NOISE = 0.002  # radians, std. dev. of theta/eta noise
+SIM_PAX_POWER = 1.0e-3  # Watts
 
 Hstate = np.array([1, 0, 0])
 Vstate = np.array([-1, 0, 0])
@@ -20,6 +93,32 @@ Rstate = np.array([0, 0, 1])
 Lstate = np.array([0, 0, -1])
 
 MAX_BUFLEN = 512
+MAX_LINELEN = 65536  # longest accepted command line
+FRAME_IDLE = 0.05  # seconds after which an unterminated command is complete
+MEAS_INTERVAL = 1.0  # seconds between measurements of the control loop
+SUB_QUEUE_LEN = 256  # telemetry records buffered per subscriber
+
+# Monte Carlo benchmark defaults
+BENCH_EPISODES = 100  # per parameter set
+BENCH_FIDELITY = 0.99
+BENCH_DRIFT_MAX = 0.02  # rad/sqrt(s), fiber random walk drawn up to this
+BENCH_RATE_MAX = 0.05  # rad/s, fiber rotation rate drawn up to this
+BENCH_MAINTAIN_TIME = 30.0  # seconds of maintain per episode
+BENCH_SAMPLE = 0.05  # seconds between true fidelity samples while maintaining
+BENCH_MAX_BELOW = 0.05  # max fraction of time below fidelity of a converged maintain episode
+BENCH_MIN_EPISODES = 30  # per parameter set, for a comparison against a baseline
+BENCH_BOOTSTRAP = 2000  # resamples of the comparison confidence bounds
+BENCH_CONFIDENCE = 0.95  # one-sided confidence of a reported regression
+
+# Client defaults
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 6000
+CLIENT_POOL_SIZE = 2  # persistent connections per client
+CLIENT_TIMEOUT = 600.0  # seconds to wait for a reply, calibrations may be slow
+CLIENT_CONNECT_TIMEOUT = 5.0
+CLIENT_RETRIES = 5  # connection attempts before giving up
+CLIENT_BACKOFF = 0.1  # seconds, doubled after every failed attempt
+CLIENT_BACKOFF_MAX = 5.0
 
 
 class CMD:
@@ -29,3 +128,19 @@ class CMD:
     MAINTAIN = "M"
     TFORM = "T"
     GET = "G"
+    WATCH = "W"
+    ABORT = "A"
+    PROTO = "PROTO"
+
+
+# Commands served from cached state without going through the control loop
+READONLY_CMDS = (CMD.GET, CMD.TFORM)
+
+# Command queue priorities, lower is served first. Commands at PRIO_PREEMPT
+# or below preempt a running calibration.
+PRIO_ABORT = 0
+PRIO_PREEMPT = 1
+PRIO_DEFAULT = 2
+CMD_PRIORITY = {CMD.ABORT: PRIO_ABORT, CMD.SET: PRIO_PREEMPT, CMD.MAINTAIN: PRIO_PREEMPT}
+# Commands running as a preemptible calibration
+PREEMPTIBLE_CMDS = (CMD.SET, CMD.MAINTAIN)
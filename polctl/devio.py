@@ -0,0 +1,70 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from polctl.metrics import DEVICE_CALL_SECONDS
+from polctl.tracing import span
+
+
+class DeviceIO(object):
+    # Runs every transaction of one instrument on a dedicated thread so that
+    # blocking serial/VISA calls never stall the event loop. A single worker
+    # also keeps the transactions to each device strictly ordered.
+    kind = "dev"
+
+    def __init__(self, dev, name, link="0"):
+        self.dev = dev
+        self.name = name
+        self.link = link
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+    def _timed(self, fn, *args):
+        # latency of the device transaction itself, without the executor queueing
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            DEVICE_CALL_SECONDS.labels(self.link, self.kind, fn.__name__).observe(
+                time.perf_counter() - start)
+
+    async def call(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        with span(f"{self.kind}.{fn.__name__}"):
+            return await loop.run_in_executor(self._executor, self._timed, fn, *args)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class AsyncEPC(DeviceIO):
+    kind = "epc"
+
+    def __init__(self, epc, name="epc", link="0"):
+        super().__init__(epc, name, link)
+
+    async def write_v(self, ch, value):
+        return await self.call(self.dev.write_v, ch, value)
+
+    async def write_vs(self, values):
+        return await self.call(self.dev.write_vs, values)
+
+
+class AsyncPAX(DeviceIO):
+    kind = "pax"
+
+    def __init__(self, pax, name="pax", link="0"):
+        super().__init__(pax, name, link)
+
+    async def snapshot(self, max_age=None):
+        return await self.call(self.dev.snapshot, max_age)
+
+    async def measure(self):
+        return await self.call(self.dev.measure)
+
+    async def stoke_vectors(self):
+        return await self.call(self.dev.stoke_vectors)
+
+    async def total_power(self):
+        return await self.call(self.dev.total_power)
+
+    async def DOP(self):
+        return await self.call(self.dev.DOP)
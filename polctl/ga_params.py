@@ -2,8 +2,10 @@ import numpy as np
 from polctl.constants import (
     DEF_GA_FIDELITY,
     DEF_GA_ITERATIONS,
+    DEF_OPTIMIZER,
     CMD
 )
+from polctl.optimizers import OPTIMIZERS
 
 
 class GAParams:
@@ -12,6 +14,8 @@ class GAParams:
         self._fidelity = DEF_GA_FIDELITY
         self._iters = DEF_GA_ITERATIONS
         self._time_limit = None
+        self._optimizer = DEF_OPTIMIZER
+        self._trace = None
 
         if not args:
             raise Exception("No arguments")
@@ -19,6 +23,12 @@ class GAParams:
             self._set_params(args, cap, ttarget)
 
     def _set_params(self, args, cap, ttarget):
+        # key=value options may follow the positional arguments
+        opts = dict(a.split("=", 1) for a in args if "=" in a)
+        args = [a for a in args if "=" not in a]
+        if not args:
+            raise Exception("No SOP argument")
+        self._set_opts(opts)
         p0 = args[0]
         if p0 == CMD.CAPTURE:
             if cap is None:
@@ -45,6 +55,20 @@ class GAParams:
         except Exception:
             pass
 
+    def _set_opts(self, opts):
+        for k, v in opts.items():
+            if k == "opt":
+                if v not in OPTIMIZERS:
+                    raise Exception(f"Unknown optimizer {v}, one of {list(OPTIMIZERS)}")
+                self._optimizer = v
+            elif k == "trace":
+                # a file name in the server's trace directory, never a path
+                if v in ("", ".", "..") or "/" in v or "\\" in v:
+                    raise Exception(f"Invalid trace file name {v}")
+                self._trace = v
+            else:
+                raise Exception(f"Unknown option {k}")
+
     @property
     def target_states(self):
         return self._targets
@@ -60,3 +84,11 @@ class GAParams:
     @property
     def time_limit(self):
         return self._time_limit
+
+    @property
+    def optimizer(self):
+        return self._optimizer
+
+    @property
+    def trace(self):
+        return self._trace
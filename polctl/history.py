@@ -0,0 +1,67 @@
+import os
+import numpy as np
+from polctl.constants import (
+    NCHAN,
+    HISTORY_CAPACITY,
+    HISTORY_FLUSH
+)
+
+
+class History(object):
+    # Fixed capacity ring buffer of real-valued rows
+    #   timestamp, V1..Vn, fidelity, S1, S2, S3
+    # When a path is given every row is also appended to that file as raw
+    # float64, which load() maps back into memory for offline analysis.
+    def __init__(self, capacity=HISTORY_CAPACITY, path=None, nchan=NCHAN):
+        self.nchan = nchan
+        self.ncols = nchan + 5
+        self.capacity = capacity
+        self._buf = np.zeros((capacity, self.ncols))
+        self._n = 0
+        self._fh = open(path, "ab") if path else None
+        self._unflushed = 0
+
+    def __len__(self):
+        return min(self._n, self.capacity)
+
+    @property
+    def total(self):
+        # rows appended since creation, including those overwritten
+        return self._n
+
+    def append(self, t, v, f, s):
+        row = self._buf[self._n % self.capacity]
+        row[0] = t
+        row[1:self.nchan+1] = v
+        row[self.nchan+1] = f
+        row[self.nchan+2:] = s
+        self._n += 1
+        if self._fh:
+            self._fh.write(row.tobytes())
+            self._unflushed += 1
+            if self._unflushed >= HISTORY_FLUSH:
+                self.flush()
+
+    def rows(self, since=0):
+        # Rows in append order, optionally only those appended after the
+        # total count was since (as far as they are still buffered)
+        start = max(since, self._n - self.capacity)
+        idx = np.arange(start, self._n) % self.capacity
+        return self._buf[idx]
+
+    def flush(self):
+        if self._fh:
+            self._fh.flush()
+            self._unflushed = 0
+
+    def close(self):
+        if self._fh:
+            self._fh.close()
+            self._fh = None
+
+    @staticmethod
+    def load(path, nchan=NCHAN):
+        ncols = nchan + 5
+        if not os.path.getsize(path):
+            return np.zeros((0, ncols))
+        return np.memmap(path, dtype=np.float64, mode="r").reshape(-1, ncols)
@@ -0,0 +1,88 @@
+import numpy as np
+from polctl.constants import (
+    NCHAN,
+    JACOBIAN_REACH,
+    JACOBIAN_MAX_STEP,
+    JACOBIAN_FORGET,
+    JACOBIAN_MIN_INFO
+)
+
+
+class JacobianModel(object):
+    # Local linear model dS = J dV of the measured Stokes vector around the
+    # current operating point. Every (voltages, Stokes) pair the controller
+    # measures is fed to update(), which applies a Broyden rank-1 update
+    # along the voltage change. Steps larger than reach move the operating
+    # point without updating J.
+    def __init__(self, nchan=NCHAN, reach=JACOBIAN_REACH, max_step=JACOBIAN_MAX_STEP,
+                 forget=JACOBIAN_FORGET):
+        self.nchan = nchan
+        self.reach = reach
+        self.max_step = max_step
+        self.forget = forget
+        self.reset()
+
+    def reset(self):
+        self.J = np.zeros((3, self.nchan))
+        self.v = None
+        self.s = None
+        self.updates = 0
+        # sum of the (decayed) normalized update directions, tells which
+        # voltage directions the model has actually seen
+        self._info = np.zeros((self.nchan, self.nchan))
+
+    @property
+    def ready(self):
+        return not self.unexplored()
+
+    def unexplored(self, channels=[1]*NCHAN):
+        # Unit voltage directions (over the enabled channels) with too little
+        # information for the model to be trusted
+        chans = np.array(channels, dtype=bool)
+        w, V = np.linalg.eigh(self._info[np.ix_(chans, chans)])
+        dirs = list()
+        for i in np.where(w <= JACOBIAN_MIN_INFO)[0]:
+            d = np.zeros(self.nchan)
+            d[chans] = V[:, i]
+            dirs.append(d)
+        return dirs
+
+    def update(self, v, s):
+        v = np.asarray(v, dtype=float)
+        s = np.asarray(s, dtype=float)
+        if self.v is not None:
+            dv = v - self.v
+            n = np.linalg.norm(dv)
+            if 0 < n <= self.reach:
+                ds = s - self.s
+                self.J += np.outer(ds - self.J @ dv, dv) / n**2
+                u = dv / n
+                self._info = self.forget*self._info + np.outer(u, u)
+                self.updates += 1
+            elif n > self.reach:
+                self._info *= self.forget
+        self.v = v
+        self.s = s
+
+    def solve(self, target_states, channels=[1]*NCHAN, s=None):
+        # Voltage step that moves the current SOP (or s) onto the target
+        # along the great circle, least squares in the tangent plane of the
+        # sphere. The best SOP for several targets is their normalized mean.
+        if self.v is None:
+            return None
+        t = np.mean(np.asarray(target_states, dtype=float), axis=0)
+        t /= np.linalg.norm(t)
+        s = self.s if s is None else np.asarray(s, dtype=float)
+        s = s / np.linalg.norm(s)
+        g = t - (t @ s)*s
+        gn = np.linalg.norm(g)
+        if gn == 0:
+            return np.zeros(self.nchan)
+        ds = np.arccos(np.clip(t @ s, -1, 1)) * g / gn
+        chans = np.array(channels, dtype=bool)
+        dv = np.zeros(self.nchan)
+        dv[chans] = np.linalg.lstsq(self.J[:, chans], ds, rcond=None)[0]
+        n = np.linalg.norm(dv)
+        if n > self.max_step:
+            dv *= self.max_step / n
+        return dv
@@ -0,0 +1,81 @@
+import numpy as np
+from polctl.constants import (
+    KALMAN_Q,
+    KALMAN_R
+)
+
+
+class DriftFilter(object):
+    # Constant velocity Kalman filter of the SOP drift. The state is the
+    # Stokes vector and its rate of change, the velocity follows a white
+    # noise acceleration with spectral density q and measurements have
+    # variance r per component. Across a voltage step of the controller the
+    # filter is rebased onto the new measurement, so the velocity only
+    # follows the fiber drift.
+    def __init__(self, q=KALMAN_Q, r=KALMAN_R):
+        self.q = q
+        self.r = r
+        self.reset()
+
+    def reset(self):
+        self.x = None
+        self.P = None
+        self.t = None
+        self.nis = 0.0
+
+    @property
+    def ready(self):
+        return self.x is not None
+
+    @property
+    def position(self):
+        return self.x[:3]
+
+    @property
+    def velocity(self):
+        return self.x[3:]
+
+    def _predict(self, dt):
+        F = np.eye(6)
+        F[:3, 3:] = dt*np.eye(3)
+        G = np.zeros((6, 6))
+        G[:3, :3] = dt**3/3*np.eye(3)
+        G[:3, 3:] = G[3:, :3] = dt**2/2*np.eye(3)
+        G[3:, 3:] = dt*np.eye(3)
+        self.x = F @ self.x
+        self.P = F @ self.P @ F.T + self.q*G
+
+    def rebase(self, t, s):
+        # Moves the position to the measurement s at time t, keeping the
+        # velocity estimate
+        self._predict(max(0.0, t - self.t))
+        self.t = t
+        self.x[:3] = np.asarray(s, dtype=float)
+        self.P[:3, :] = self.P[:, :3] = 0
+        self.P[:3, :3] = self.r*np.eye(3)
+
+    def update(self, t, s):
+        # Filter the measurement s taken at time t. Returns the normalized
+        # innovation squared, chi-square with 3 degrees of freedom while
+        # the model holds.
+        s = np.asarray(s, dtype=float)
+        if self.x is None:
+            self.x = np.concatenate((s, np.zeros(3)))
+            self.P = np.diag([self.r]*3 + [self.q]*3)
+            self.t = t
+            self.nis = 0.0
+            return self.nis
+        self._predict(max(0.0, t - self.t))
+        self.t = t
+        y = s - self.x[:3]
+        S = self.P[:3, :3] + self.r*np.eye(3)
+        K = self.P[:, :3] @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(6) - K @ np.eye(3, 6)) @ self.P
+        self.nis = float(y @ np.linalg.solve(S, y))
+        return self.nis
+
+    def forecast(self, dt):
+        # predicted SOP dt seconds after the last measurement, on the sphere
+        s = self.x[:3] + dt*self.x[3:]
+        return s / np.linalg.norm(s)
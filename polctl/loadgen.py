@@ -0,0 +1,96 @@
+import time
+import json
+import random
+import asyncio
+import argparse
+import logging
+import numpy as np
+from polctl.aclient import PolClient, CommandError
+from polctl.constants import (
+    SERVER_HOST,
+    SERVER_PORT
+)
+
+log = logging.getLogger(__name__)
+
+
+# Command mix entry CMD[ ARGS...][:WEIGHT], e.g. "G SOP:10"
+def parse_mix(spec):
+    cmd, _, weight = spec.rpartition(":")
+    if not cmd or not weight.replace(".", "", 1).isdigit():
+        cmd, weight = spec, 1
+    return cmd.split(), float(weight)
+
+
+async def _worker(client, mix, weights, deadline, stats, link):
+    while time.monotonic() < deadline:
+        msg = random.choices(mix, weights)[0]
+        key = " ".join(msg)
+        st = stats.setdefault(key, {"lat": list(), "errors": 0})
+        start = time.perf_counter()
+        try:
+            await client.request(msg[0], *msg[1:], link=link)
+            st["lat"].append(time.perf_counter() - start)
+        except (CommandError, ConnectionError, asyncio.TimeoutError) as e:
+            log.debug(f"{key}: {e}")
+            st["errors"] += 1
+
+
+def report(stats, elapsed):
+    out = dict()
+    for key, st in sorted(stats.items()):
+        lat = np.array(st["lat"])
+        out[key] = {"count": len(lat),
+                    "errors": st["errors"],
+                    "throughput": len(lat)/elapsed,
+                    "p50_ms": float(np.percentile(lat, 50)*1e3) if len(lat) else None,
+                    "p99_ms": float(np.percentile(lat, 99)*1e3) if len(lat) else None}
+    return out
+
+
+async def run(host, port, clients, pool, duration, mix, link=None):
+    cmds = [m[0] for m in mix]
+    weights = [m[1] for m in mix]
+    stats = dict()
+    conns = [PolClient(host, port, size=pool) for i in range(clients)]
+    start = time.monotonic()
+    try:
+        await asyncio.gather(*[_worker(c, cmds, weights, start + duration, stats, link)
+                               for c in conns])
+    finally:
+        for c in conns:
+            await c.close()
+    return report(stats, time.monotonic() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Drive concurrent clients against a pol_ctl server and report "
+                    "throughput and latency per command")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("-n", "--clients", type=int, default=8)
+    parser.add_argument("--pool", type=int, default=1, help="connections per client")
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--link", default=None)
+    parser.add_argument("-c", "--cmd", action="append", type=parse_mix, default=None,
+                        help="command and optional weight, CMD[ ARGS...][:WEIGHT], "
+                             "may be repeated (default 'G SOP')")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+    mix = args.cmd or [(["G", "SOP"], 1.0)]
+    res = asyncio.run(run(args.host, args.port, args.clients, args.pool, args.duration,
+                          mix, args.link))
+    if args.json:
+        print(json.dumps(res, indent=2))
+        return
+    print(f"{'command':<20} {'count':>8} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for key, r in res.items():
+        p50 = "-" if r["p50_ms"] is None else f"{r['p50_ms']:.2f}"
+        p99 = "-" if r["p99_ms"] is None else f"{r['p99_ms']:.2f}"
+        print(f"{key:<20} {r['count']:>8} {r['errors']:>7} {r['throughput']:>9.1f} "
+              f"{p50:>9} {p99:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+import bisect
+import asyncio
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+DURATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _fmt_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    inner = ",".join(f'{k}="{str(v)}"' for k, v in pairs)
+    return "{" + inner + "}"
+
+
+def _fmt_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v))
+
+
+class _Counter(object):
+    def __init__(self):
+        self.value = 0.0
+        self._func = None
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set_function(self, func):
+        # value is read from func at collection time, func must not decrease
+        self._func = func
+
+    def samples(self, name):
+        yield name, None, self._func() if self._func else self.value
+
+
+class _Gauge(object):
+    def __init__(self):
+        self.value = 0.0
+        self._func = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, func):
+        # value is read from func at collection time
+        self._func = func
+
+    def samples(self, name):
+        yield name, None, self._func() if self._func else self.value
+
+
+class _Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0]*(len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name):
+        acc = 0
+        for b, c in zip(self.buckets + (float("inf"),), self.counts):
+            acc += c
+            yield f"{name}_bucket", ("le", _fmt_value(b)), acc
+        yield f"{name}_sum", None, self.sum
+        yield f"{name}_count", None, acc
+
+
+class Metric(object):
+    # A metric family with optional labels, children are created on first use
+    def __init__(self, kind, name, doc, labelnames=(), **kwargs):
+        self.kind = kind
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._kwargs = kwargs
+        self._children = dict()
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new())
+        return child
+
+    def _new(self):
+        if self.kind == "counter":
+            return _Counter()
+        elif self.kind == "gauge":
+            return _Gauge()
+        return _Histogram(self._kwargs.get("buckets", LATENCY_BUCKETS))
+
+    def remove(self, *values):
+        self._children.pop(tuple(str(v) for v in values), None)
+
+    # unlabelled metrics are used directly
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            for name, extra, v in child.samples(self.name):
+                lines.append(f"{name}{_fmt_labels(self.labelnames, values, extra)} "
+                             f"{_fmt_value(v)}")
+        return "\n".join(lines)
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = dict()
+
+    def _add(self, kind, name, doc, labelnames=(), **kwargs):
+        if name not in self._metrics:
+            self._metrics[name] = Metric(kind, name, doc, labelnames, **kwargs)
+        return self._metrics[name]
+
+    def counter(self, name, doc, labelnames=()):
+        return self._add("counter", name, doc, labelnames)
+
+    def gauge(self, name, doc, labelnames=()):
+        return self._add("gauge", name, doc, labelnames)
+
+    def histogram(self, name, doc, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add("histogram", name, doc, labelnames, buckets=tuple(buckets))
+
+    def render(self):
+        # Prometheus text exposition format
+        return "\n".join(m.render() for m in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+DEVICE_CALL_SECONDS = REGISTRY.histogram(
+    "polctl_device_call_seconds", "Latency of EPC and polarimeter calls",
+    ("link", "device", "call"))
+EVALUATIONS = REGISTRY.counter(
+    "polctl_evaluations_total", "Hardware evaluations (EPC write and settled measurement)",
+    ("link",))
+GA_RUNS = REGISTRY.counter(
+    "polctl_ga_runs_total", "Calibration runs by outcome", ("link", "optimizer", "result"))
+GA_EVALUATIONS = REGISTRY.histogram(
+    "polctl_ga_evaluations", "Hardware evaluations per calibration run",
+    ("link", "optimizer"), buckets=COUNT_BUCKETS)
+GA_ITERATIONS = REGISTRY.histogram(
+    "polctl_ga_iterations", "Optimizer iterations per calibration run",
+    ("link", "optimizer"), buckets=COUNT_BUCKETS)
+GA_TIME_TO_FIDELITY = REGISTRY.histogram(
+    "polctl_ga_time_to_fidelity_seconds", "Wall time of calibration runs reaching their threshold",
+    ("link", "optimizer"), buckets=DURATION_BUCKETS)
+PREEMPTIONS = REGISTRY.counter(
+    "polctl_preemptions_total", "Calibrations stopped by a more urgent command", ("link", "cmd"))
+RECALIBRATIONS = REGISTRY.counter(
+    "polctl_recalibrations_total", "Scheduled recalibrations, run or deferred by a quiet window",
+    ("link", "result"))
+RECAL_INTERVAL = REGISTRY.gauge(
+    "polctl_recal_interval_seconds", "Current check interval of the recalibration scheduler",
+    ("link",))
+SETTLE_SECONDS = REGISTRY.histogram(
+    "polctl_settle_seconds", "EPC settle wait per evaluation", ("link",))
+SETTLE_TIMEOUTS = REGISTRY.counter(
+    "polctl_settle_timeouts_total", "Settle waits ended by max_wait before the SOP settled",
+    ("link",))
+LOOP_JITTER = REGISTRY.histogram(
+    "polctl_loop_tick_jitter_seconds", "Wake-up delay of measurement ticks past their schedule",
+    ("link",))
+QUEUE_DEPTH = REGISTRY.gauge(
+    "polctl_queue_depth", "Commands waiting for the control loop", ("link",))
+SUBSCRIBERS = REGISTRY.gauge(
+    "polctl_subscribers", "Telemetry subscriptions", ("link",))
+TELEMETRY_DROPPED = REGISTRY.counter(
+    "polctl_telemetry_dropped_total", "Telemetry records dropped for subscribers falling behind",
+    ("link",))
+FIDELITY = REGISTRY.gauge(
+    "polctl_fidelity", "Last measured fidelity to the current target", ("link",))
+
+
+async def _handle_http(reader, writer, registry):
+    try:
+        request = await reader.readline()
+        # drain the headers
+        while (await reader.readline()).strip():
+            pass
+        parts = request.decode().split(" ")
+        if len(parts) > 1 and parts[0] == "GET" and parts[1].split("?")[0] in ("/", "/metrics"):
+            body = registry.render().encode()
+            status = "200 OK"
+        else:
+            body = b"not found\n"
+            status = "404 Not Found"
+        writer.write(f"HTTP/1.0 {status}\r\n"
+                     "Content-Type: text/plain; version=0.0.4\r\n"
+                     f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await writer.drain()
+    except Exception as e:
+        log.error(f"Metrics request failed: {e}")
+    finally:
+        writer.close()
+
+
+async def serve_metrics(host, port, registry=REGISTRY):
+    server = await asyncio.start_server(
+        lambda r, w: _handle_http(r, w, registry), host, port)
+    log.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
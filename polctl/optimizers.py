@@ -0,0 +1,167 @@
+import logging
+import numpy as np
+from polctl.constants import (
+    STEP,
+    NCHAN,
+    LEARNING_RATE,
+    SPSA_A,
+    SPSA_C,
+    SPSA_ALPHA,
+    SPSA_GAMMA,
+    SPSA_STABILITY,
+    PATTERN_STEP,
+    PATTERN_DECAY
+)
+
+
+log = logging.getLogger(__name__)
+
+
+class Optimizer(object):
+    # An optimizer advances the EPC voltages one iteration at a time.
+    # evaluate is a coroutine returning the fidelity at the given voltages,
+    # every call is one (expensive) hardware evaluation, counted by the
+    # controller.
+    name = None
+
+    def __init__(self, evaluate, channels=[1]*NCHAN):
+        self.evaluate = evaluate
+        self.channels = np.array(channels, dtype=bool)
+
+    def start(self, params, inner):
+        pass
+
+    async def step(self, params, inner):
+        # Returns the new (params, inner)
+        raise NotImplementedError
+
+
+class GradientOptimizer(Optimizer):
+    # Finite difference ascent, perturbs a random subset of the channels
+    # by STEP and advances along the measured change.
+    name = "gradient"
+
+    def __init__(self, evaluate, channels=[1]*NCHAN, learning_rate=None):
+        super().__init__(evaluate, channels)
+        self.learning_rate = LEARNING_RATE if learning_rate is None else learning_rate
+        self.pgrad = None
+
+    def start(self, params, inner):
+        self.pgrad = params.copy()
+
+    async def step(self, params, inner):
+        gchange = False
+        while not gchange:
+            for i, v in enumerate(self.channels):
+                if v and np.random.rand() > 0.5:
+                    self.pgrad[i] += STEP
+                    gchange = True
+        self.pgrad, inner = await self.grad_func(params, self.pgrad, self.learning_rate, inner)
+        return self.pgrad.copy(), inner
+
+    async def grad_func(self, params0, params1, learning_rate, inner_prev=None):
+        if not inner_prev:
+            inner_prev = await self.evaluate(params0)
+        inner_adv = await self.evaluate(params1)
+        # since calculating gradient is the most expensive operation here,
+        # we will advance the state directly while calculating inner product
+        # cost function is given by the deviation of inner product and 1
+        delta_p = -(params1 - params0) * (abs(1 - inner_adv) -
+                                          abs(1 - inner_prev)) * learning_rate
+        if (inner_adv - inner_prev) < 0:
+            params0 += delta_p
+            inner_curr = await self.evaluate(params0)
+            return (params0, inner_curr)  # if inner product decreases, advance from the previous direction
+        else:
+            params1 += delta_p
+            inner_curr = await self.evaluate(params1)
+            return (params1, inner_curr)  # if inner product increases, advance directly
+
+
+class SPSAOptimizer(Optimizer):
+    # Simultaneous perturbation: all enabled channels are perturbed at once
+    # by a random +/-c_k pattern, so one extra evaluation gives a gradient
+    # estimate for every channel. Two evaluations per iteration.
+    name = "spsa"
+
+    def __init__(self, evaluate, channels=[1]*NCHAN, a=SPSA_A, c=SPSA_C,
+                 alpha=SPSA_ALPHA, gamma=SPSA_GAMMA, stability=SPSA_STABILITY):
+        super().__init__(evaluate, channels)
+        self.a = a
+        self.c = c
+        self.alpha = alpha
+        self.gamma = gamma
+        self.stability = stability
+        self.k = 0
+
+    def start(self, params, inner):
+        self.k = 0
+
+    async def step(self, params, inner):
+        ak = self.a / (self.k + 1 + self.stability)**self.alpha
+        ck = max(STEP, self.c / (self.k + 1)**self.gamma)
+        self.k += 1
+        delta = np.where(np.random.rand(NCHAN) > 0.5, 1.0, -1.0) * self.channels
+        pplus = params + ck*delta
+        inner_plus = await self.evaluate(pplus)
+        # one sided estimate against the current point
+        grad = (inner_plus - inner) / ck * delta
+        if inner_plus > inner:
+            params, inner = pplus, inner_plus
+        pnext = params + ak*grad
+        inner_next = await self.evaluate(pnext)
+        if inner_next < inner:
+            return params, inner
+        return pnext, inner_next
+
+
+class PatternOptimizer(Optimizer):
+    # Compass (pattern) search: polls one enabled channel per iteration in
+    # both directions, keeps any improvement and halves the step after a
+    # full sweep without one. One or two evaluations per iteration.
+    name = "pattern"
+
+    def __init__(self, evaluate, channels=[1]*NCHAN, step=PATTERN_STEP, decay=PATTERN_DECAY):
+        super().__init__(evaluate, channels)
+        self.init_step = step
+        self.decay = decay
+        self.step_size = step
+        self._chans = [i for i, v in enumerate(channels) if v]
+        self._idx = 0
+        self._fails = 0
+
+    def start(self, params, inner):
+        self.step_size = self.init_step
+        self._idx = 0
+        self._fails = 0
+
+    async def step(self, params, inner):
+        ch = self._chans[self._idx % len(self._chans)]
+        self._idx += 1
+        for sign in (1, -1):
+            p = params.copy()
+            p[ch] += sign*self.step_size
+            f = await self.evaluate(p)
+            if f > inner:
+                self._fails = 0
+                return p, f
+        self._fails += 1
+        if self._fails >= len(self._chans):
+            self._fails = 0
+            self.step_size = max(STEP, self.step_size*self.decay)
+        return params, inner
+
+
+OPTIMIZERS = {
+    GradientOptimizer.name: GradientOptimizer,
+    SPSAOptimizer.name: SPSAOptimizer,
+    PatternOptimizer.name: PatternOptimizer,
+}
+
+
+def get_optimizer(name, evaluate, channels=[1]*NCHAN):
+    try:
+        cls = OPTIMIZERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown optimizer: {name}")
+    return cls(evaluate, channels=channels)
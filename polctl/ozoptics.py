@@ -1,11 +1,51 @@
-import serial
-import numpy as np
+import queue
+import threading
+import collections
+from polctl.constants import EPC_PORT, EPC_VMAX, EPC_MAX_PENDING, EPC_QUERY_TIMEOUT, NCHAN
+
+try:
+    import serial
+except ImportError:
+    serial = None
 
 
 class EPCDriver(object):
-    def __init__(self, port="/dev/ttyUSB1", baudrate=9600, debug=False):
+    # ser may be any object with the pyserial write()/read()/readline()
+    # interface, e.g. the simulated EPC in polctl.sim
+    def __init__(self, port=EPC_PORT, baudrate=9600, debug=False, ser=None, nchan=NCHAN):
+        if ser is None:
+            ser = self._open(port, baudrate)
+        self.ser = ser
+        self.debug = debug
+        self.buflen = 2048
+        self.nchan = nchan
+        # Last voltage sent to the EPC per channel
+        self._sent = [None]*nchan
+        # Voltage commands awaiting a response, in send order, and whether
+        # a query owns the responses
+        self._pending = collections.deque()
+        self._query = False
+        self._responses = queue.Queue()
+        self._lock = threading.Condition()
+        # Traffic counters
+        self.bytes_sent = 0
+        self.commands_sent = 0
+        self.writes_skipped = 0
+        self._reader = None
+        self._running = False
+        self._ask("MDC")
+        if self.ser:
+            self._running = True
+            self._reader = threading.Thread(target=self._read_responses, name="epc-reader",
+                                            daemon=True)
+            self._reader.start()
+
+    @staticmethod
+    def _open(port, baudrate):
+        if serial is None:
+            raise ImportError("pyserial is required for the hardware EPC backend")
         try:
-            self.ser = serial.Serial(
+            return serial.Serial(
                 port=port,
                 baudrate=baudrate,
                 timeout=1,
@@ -13,32 +53,107 @@ class EPCDriver(object):
                 stopbits=serial.STOPBITS_ONE
             )
         except serial.serialutil.SerialException:
-            self.ser = None
-        self.debug = debug
-        self.buflen = 2048
-        self._ask("MDC")
+            return None
 
     @property
     def okay(self):
         return True if self.ser else False
 
     def _ask(self, cmd):
-        if self.ser:
-            self.ser.write(f'{cmd}\r\n'.encode())
-            if self.debug:
-                print("rc: {rc} for {cmd}")
+        if not self.ser:
+            return None
+        if self._reader is None:
+            self._send(f'{cmd}\r\n'.encode(), 1)
             return self.ser.read(self.buflen).decode()
+        # The reader thread owns the port. The query waits until the
+        # pipelined voltage commands are answered, then every line until
+        # the EPC falls silent answers it. Voltage writes wait meanwhile.
+        with self._lock:
+            if not self._lock.wait_for(lambda: not self._pending and not self._query,
+                                       timeout=EPC_QUERY_TIMEOUT):
+                raise IOError(f"EPC did not answer {len(self._pending)} commands")
+            self._query = True
+        lines = list()
+        try:
+            # drop unsolicited lines
+            while not self._responses.empty():
+                self._responses.get_nowait()
+            self._send(f'{cmd}\r\n'.encode(), 1)
+            while True:
+                lines.append(self._responses.get(timeout=EPC_QUERY_TIMEOUT))
+        except queue.Empty:
+            pass
+        finally:
+            with self._lock:
+                self._query = False
+                self._lock.notify_all()
+        return "".join(lines)
+
+    def _send(self, data, ncmds):
+        self.ser.write(data)
+        self.bytes_sent += len(data)
+        self.commands_sent += ncmds
+
+    def _read_responses(self):
+        # Matches responses to the pipelined voltage commands in order, a
+        # channel whose command failed is sent again on the next write
+        while self._running:
+            try:
+                line = self.ser.readline().decode().strip()
+            except Exception:
+                break
+            if not line:
+                continue
+            with self._lock:
+                if not self._pending:
+                    # answers a query, or is unsolicited
+                    self._responses.put(line + "\r\n")
+                    continue
+                ch, value = self._pending.popleft()
+                if not line.startswith("Done") and self._sent[ch-1] == value:
+                    # failed, make sure the value is sent again next time
+                    self._sent[ch-1] = None
+                if not self._pending:
+                    self._lock.notify_all()
 
     @property
     def help(self):
         return self._ask("?")
 
     def write_v(self, ch, value):
-        value = int(value)
-        if (value > 5000) or (value < -5000):
-            value = 5000 * np.sign(value)
-        else:
-            command = f'V{ch},{value}\r\n'
-            encoded_command = command.encode()
-            self.ser.write(encoded_command)
+        return self.write_vs({ch: value})
+
+    def write_vs(self, values):
+        # values is a sequence of voltages for channels 1..n or a dict of
+        # {channel: voltage}. Values are clamped to the EPC range, channels
+        # already at their value are skipped and the rest are sent in a
+        # single serial write.
+        if not isinstance(values, dict):
+            values = {ch+1: v for ch, v in enumerate(values)}
+        cmds = list()
+        with self._lock:
+            # a running query owns the responses
+            self._lock.wait_for(lambda: not self._query)
+            if len(self._pending) + len(values) > EPC_MAX_PENDING:
+                raise IOError(f"EPC did not answer {len(self._pending)} commands")
+            for ch, value in values.items():
+                value = max(-EPC_VMAX, min(EPC_VMAX, int(value)))
+                if self._sent[ch-1] == value:
+                    self.writes_skipped += 1
+                    continue
+                self._sent[ch-1] = value
+                self._pending.append((ch, value))
+                cmds.append(f'V{ch},{value}\r\n')
+        if cmds:
+            self._send("".join(cmds).encode(), len(cmds))
         return 0
+
+    def counters(self):
+        return {"bytes_sent": self.bytes_sent,
+                "commands_sent": self.commands_sent,
+                "writes_skipped": self.writes_skipped}
+
+    def close(self):
+        self._running = False
+        if self._reader is not None:
+            self._reader.join(timeout=2)
@@ -1,9 +1,58 @@
-import pyvisa as visa
-from cmath import cos, sin
+import time
+from polctl.sop import stokes
+from polctl.constants import PAX_RESOURCE, PAX_MODEL, PAX_SNAPSHOT_TTL
+
+try:
+    import pyvisa as visa
+except ImportError:
+    visa = None
+
+
+class Measurement(object):
+    # One SENS:DATA:LAT? record
+    # 0:revs, 1:timestamp, 2:paxOpMode, 3:paxFlags (s. Kap. 3.6.4.2.3.1), 4:paxTIARange, 5:adcMin, 6:adcMax,
+    # 7:revTime, 8:misAdj, 9:theta, 10:eta, 11:DOP, 12:Ptotal
+    __slots__ = ("fields", "revs", "timestamp", "mode", "theta", "eta", "DOP", "Ptotal",
+                 "stokes", "time")
+
+    def __init__(self, raw, now=None):
+        li = raw.strip('\n').split(',')
+        self.fields = li
+        self.revs = int(float(li[0]))
+        self.timestamp = float(li[1])
+        self.mode = li[2]
+        self.theta = float(li[9])
+        self.eta = float(li[10])
+        self.DOP = float(li[11])
+        self.Ptotal = float(li[12])
+        # normalized S1, S2, S3
+        self.stokes = stokes(self.theta, self.eta)
+        # local receive time, used for cache expiry
+        self.time = time.monotonic() if now is None else now
+
+    def __repr__(self):
+        return (f"Measurement(revs={self.revs}, theta={self.theta}, eta={self.eta}, "
+                f"DOP={self.DOP}, Ptotal={self.Ptotal})")
 
 
 class PAX1000(object):
-    def __init__(self, device='USB0::4883::32817::M00937524::0::INSTR'):
+    # inst may be any object with the pyvisa query()/write() interface,
+    # e.g. the simulated polarimeter in polctl.sim
+    def __init__(self, device=PAX_RESOURCE, inst=None, ttl=PAX_SNAPSHOT_TTL):
+        if inst is None:
+            inst = self._open(device)
+        self.inst = inst
+        # USB0::vendor::product::serial::0::INSTR
+        fields = device.split("::")
+        self.serial = fields[3] if len(fields) > 3 else None
+        # Last measurement is shared by every reader within ttl seconds
+        self.ttl = ttl
+        self._last = None
+
+    @staticmethod
+    def _open(device):
+        if visa is None:
+            raise ImportError("pyvisa is required for the hardware PAX1000 backend")
         # pyvisa-py
         rm = visa.ResourceManager('@py')
 
@@ -13,11 +62,11 @@ class PAX1000(object):
         print(rm)
         print(rm.list_resources("?*"))
         # pybisa-py
-        self.inst = rm.open_resource(
+        return rm.open_resource(
             resource_name=device, write_termination='\n', read_termination='\n')
 
         # NI-VISA
-        # self.inst = rm.open_resource(device=device)
+        # return rm.open_resource(device=device)
 
     def reset(self):
         # Returns the unit to the *RST default condition
@@ -31,39 +80,47 @@ class PAX1000(object):
         # Returns the unit's identification string
         return self.inst.query('*IDN?')
 
+    @property
+    def okay(self):
+        # Expected model, with the serial number of the opened resource
+        idn = self.qry().strip().split(",")
+        if ",".join(idn[:2]) != PAX_MODEL:
+            return False
+        return self.serial is None or (len(idn) > 2 and idn[2] == self.serial)
+
     def wavelength(self):
         # Returns wavelength in [m]
         return self.inst.query(
             'SENS:CORR:WAV?')
 
+    def snapshot(self, max_age=None):
+        # Returns the cached measurement if it is younger than max_age
+        # (default ttl), otherwise queries the polarimeter. max_age=0
+        # always queries.
+        max_age = self.ttl if max_age is None else max_age
+        m = self._last
+        if m is not None and time.monotonic() - m.time < max_age:
+            return m
+        self._last = Measurement(self.inst.query('SENS:DATA:LAT?'))
+        return self._last
+
     def mode(self):
-        return self.inst.query('SENS:DATA:LAT?').strip('\n').split(',')[2]
-        # 0:revs, 1:timestamp, 2:paxOpMode, 3:paxFlags (s. Kap. 3.6.4.2.3.1), 4:paxTIARange, 5:adcMin, 6:adcMax,
-        # 7:revTime, 8:misAdj, 9:theta, 10:eta, 11:DOP, 12:Ptotal
+        return self.snapshot().mode
 
     def measure(self):
-        return self.inst.query(
-            'SENS:DATA:LAT?').strip('\n').split(',')
+        return self.snapshot().fields
 
     def DOP(self):
-        return float(self.inst.query(
-            'SENS:DATA:LAT?').strip('\n').split(',')[11])*100
+        return self.snapshot().DOP*100
 
     def total_power(self):
-        return float(self.inst.query(
-            'SENS:DATA:LAT?').strip('\n').split(',')[12])
+        return self.snapshot().Ptotal
 
     def write(self, cmd):
         self.inst.write(cmd)
 
     def stoke_vectors(self):
-        li = self.measure()
-        psi = float(li[9])
-        chi = float(li[10])
-        S1 = cos(2*psi)*cos(2*chi)  # normalized S1
-        S2 = sin(2*psi)*cos(2*chi)  # normalized S2
-        S3 = sin(2*chi)             # normalized S3
-        return [S1, S2, S3]
+        return list(self.snapshot().stokes)
 
     def inp_wav(self, wavelength):     # range -> (900 - 1700)nm
         self.inst.write(f'SENS:CORR:WAV {float(wavelength)};:INP:ROT:STAT 1')
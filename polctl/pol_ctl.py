@@ -1,24 +1,71 @@
-import sys
+import os
 import time
 import asyncio
+import argparse
+import json
+import functools
 import logging
 import numpy as np
 from polctl.ga_params import GAParams
-from polctl.pax1000 import PAX1000
-from polctl.ozoptics import EPCDriver
-from polctl.sop import transform
+from polctl.backends import BACKENDS, open_devices
+from polctl.devio import AsyncEPC, AsyncPAX
+from polctl.settle import SettleEngine
+from polctl.optimizers import get_optimizer
+from polctl.jacobian import JacobianModel
+from polctl.kalman import DriftFilter
+from polctl.capture import StokesStats
+from polctl.cmdqueue import CommandQueue, Preempted
+from polctl.scheduler import RecalScheduler, parse_quiet
+from polctl.history import History
+from polctl.warmstart import WarmStartIndex
+from polctl.seeding import QuasiRandomSeeder
+from polctl.telemetry import Publisher
+from polctl import metrics
+from polctl.tracing import span, trace
+from polctl.protocol import (
+    Reply,
+    PROTO_TEXT,
+    PROTO_JSON,
+    PROTO_BIN,
+    PROTOS,
+    FRAME_REPLY,
+    FRAME_TELEMETRY,
+    reply_dict,
+    encode_json,
+    encode_frame,
+    pack_telemetry,
+    valid_telemetry_id,
+    read_lines
+)
+from polctl.sop import transform, fidelity
 from polctl.constants import (
-    MAX_BUFLEN,
+    MEAS_INTERVAL,
+    SERVER_HOST,
+    SERVER_PORT,
+    READONLY_CMDS,
+    PREEMPTIBLE_CMDS,
+    PRIO_PREEMPT,
     CMD,
     WAVELENGTH,
     DEF_CAP_SAMPLES,
-    DEF_CAP_SAMPLE_SLEEP,
+    CAP_MIN_SAMPLES,
+    CAP_POLL,
+    CAP_TIMEOUT,
+    FRAME_IDLE,
     DEF_GA_RAND_ITERS,
     DEF_GA_RAND_THRESH,
-    STEP,
     NCHAN,
-    LEARNING_RATE,
-    EPC_SLEEP_TIME,
+    EPC_VMAX,
+    DEF_OPTIMIZER,
+    JACOBIAN_STEPS,
+    JACOBIAN_PROBE,
+    JACOBIAN_REACH,
+    KALMAN_GATE,
+    KALMAN_ESCALATE,
+    KALMAN_DEADBAND,
+    WARMSTART_K,
+    EPC_PORT,
+    PAX_RESOURCE,
     Hstate
 )
 
@@ -26,31 +73,48 @@ from polctl.constants import (
 log = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-lock = asyncio.Lock()
-sq = asyncio.Queue()
-rq = asyncio.Queue()
-
 
 class PolarizationControl:
-    def __init__(self, pinit=None):
+    def __init__(self, pinit=None, epc=None, pax=None, history=None, warm=None, name="0",
+                 interval=MEAS_INTERVAL, trace_dir=None):
+        # link id and command queue of this controller, commands carry the
+        # futures for their reply
+        self.name = name
+        self.rq = CommandQueue()
+        self._replies = []
+        # set to stop the running calibration at its next evaluation, and
+        # the voltages a stopped calibration left the EPC at
+        self._preempt = False
+        self._preempted = False
+        self._resume = None
+        # seconds between measurements while idle, the recalibration
+        # scheduler may override it in the measure mode
+        self.interval = interval
+        self.idle_interval = None
+        self.scheduler = None
+        # directory of the trace= files, tracing is off without it
+        self.trace_dir = trace_dir
         # cmd state
         self._curcmd = CMD.MEAS
         self._curargs = None
         self._prevcmd = CMD.MEAS
         self._prevargs = None
+        self._last_set = None
         # Initial SOP parameters
         self._pinit = pinit
         self._phist = None
         self._cap = None
         self._ttarget = None
         self._sop = None
-        # Initializing EPC driver and Polarimeter
-        self.epc = EPCDriver()
-        self.pax = PAX1000()
+        # Initializing EPC driver and Polarimeter, hardware unless given
+        if epc is None or pax is None:
+            epc, pax = open_devices("hw")
+        self.epc = epc
+        self.pax = pax
         # Check if EPC and Polarimeter are accessible
         if not self.epc.okay:
             raise Exception("EPC device is not accessible!")
-        if self.pax.qry() != "THORLABS,PAX1000IR2,M00937524,1.0.13":
+        if not self.pax.okay:
             raise Exception("Polarimeter device is not accessible!")
         # Print initial information
         # 2 revolutions for one measurement, 2048 points for FFT
@@ -61,6 +125,32 @@ class PolarizationControl:
         self.pax.inp_wav(wavelength=WAVELENGTH)
         wav = self.pax.wavelength()
         log.info(f"Wavelength: {wav}")
+        # Awaitable device I/O, each instrument on its own thread
+        self.epc_io = AsyncEPC(self.epc, name=f"epc-{name}", link=name)
+        self.pax_io = AsyncPAX(self.pax, name=f"pax-{name}", link=name)
+        self.settle = SettleEngine(self.pax_io)
+        self._vlast = None
+        self.jac = JacobianModel()
+        # SOP drift tracking of the maintain mode, voltages the filter
+        # state was last measured at and consecutive outliers
+        self.kf = DriftFilter()
+        self._kf_v = None
+        self._kf_outliers = 0
+        # Hardware evaluations of the last calibration
+        self._evals = 0
+        self._evals_to_fidelity = None
+        self._seed_evals = 0
+        # Every evaluation and fidelity measurement
+        self.history = history if history is not None else History()
+        # Converged solutions used to seed calibration
+        self.warm = warm if warm is not None else WarmStartIndex()
+        # Measurement stream for subscribed clients
+        self.telemetry = Publisher()
+        # random source of the seed sweep
+        self.rng = np.random.default_rng()
+        metrics.QUEUE_DEPTH.labels(name).set_function(self.rq.qsize)
+        metrics.SUBSCRIBERS.labels(name).set_function(lambda: len(self.telemetry))
+        metrics.TELEMETRY_DROPPED.labels(name).set_function(lambda: self.telemetry.dropped)
 
     def _prev_cmd(self):
         self._curcmd = self._prevcmd
@@ -70,30 +160,50 @@ class PolarizationControl:
         self._curcmd = CMD.MEAS
         self._curargs = None
 
-    async def _get_cmd(self):
+    async def _get_cmd(self, timeout=0):
+        # Waits up to timeout seconds for a new command, a queued command
+        # is taken even when the last tick overran
         new = True
         try:
-            msg = rq.get_nowait()
+            msg = await asyncio.wait_for(self.rq.get(),
+                                         timeout=timeout if self.rq.empty() else None)
             self._prevcmd = self._curcmd
             self._prevargs = self._curargs
             self._curcmd = msg.get("cmd")
             self._curargs = msg.get("args")
+            self._replies = msg.get("replies")
             log.info(f"cmd: {self._curcmd}, args: {self._curargs}")
-        except asyncio.QueueEmpty:
+        except asyncio.TimeoutError:
             new = False
         return self._curcmd, self._curargs, new
 
+    async def submit(self, cmd, args):
+        # Queues a command for the control loop and waits for its reply
+        reply = asyncio.get_running_loop().create_future()
+        await self.rq.put(cmd, args, reply)
+        return await reply
+
+    async def handle_readonly(self, cmd, args):
+        # Commands that only use cached state are served without the loop
+        if cmd == CMD.GET:
+            return await self._handle_get(cmd, args)
+        elif cmd == CMD.TFORM:
+            return await self._handle_transform(cmd, args)
+        return "ERR UNKNOWN_CMD"
+
     async def _handle_get(self, cmd, args):
+        if not args:
+            return "ERR NO_ARGS"
         if args[0] == CMD.CAPTURE:
-            return f"OK {self._cap}"
+            return Reply(f"OK {self._cap}", self._cap)
         elif args[0] == CMD.TFORM:
-            return f"OK {self._ttarget}"
+            return Reply(f"OK {self._ttarget}", self._ttarget)
         elif args[0] == "SOP":
             if self._cap is not None:
-                inner_product = (self._sop*self._cap).sum()
-                return f"OK {self._sop} f={float(inner_product.real)}"
+                f = float(fidelity(self._sop, self._cap)[0])
+                return Reply(f"OK {self._sop} f={f}", self._sop, f=f)
             else:
-                return f"OK {self._sop}"
+                return Reply(f"OK {self._sop}", self._sop)
         else:
             return "ERR UNKNOWN_ARGS"
 
@@ -107,15 +217,39 @@ class PolarizationControl:
         try:
             self._ttarget = transform(self._cap, int(args[0]))
             log.info(f"Calculated new target SOP: {self._ttarget}")
-            return f"OK {self._ttarget}"
+            return Reply(f"OK {self._ttarget}", self._ttarget)
         except Exception as e:
             log.error(f"Could not transform: {e}")
             return "ERR EXCEPTION"
 
+    @property
+    def busy(self):
+        # calibrating, maintaining or handling a command
+        return self._curcmd != CMD.MEAS
+
+    @property
+    def last_set(self):
+        # arguments of the last successful Set
+        return self._last_set
+
+    def params(self, args):
+        # GA params of Set / Maintain args, raises LookupError for a
+        # missing capture or transform target
+        params = GAParams(args, self._cap, self._ttarget)
+        if params.trace and self.trace_dir is None:
+            raise Exception("Tracing is off, start the server with --trace-dir")
+        return params
+
+    def _trace_path(self, params):
+        return params.trace and os.path.join(self.trace_dir, params.trace)
+
     async def _handle_meas(self, cmd, args, maintain=False):
         inner_product = "N/A"
-        v = np.array(self.pax.stoke_vectors())
+        m = await self.pax_io.snapshot()
+        v = m.stokes
         self._sop = v
+        if self._vlast is not None:
+            self.jac.update(self._vlast, v)
 
         if maintain and not args:
             log.error("No argument given, specify maintain target")
@@ -123,35 +257,59 @@ class PolarizationControl:
 
         if args:
             try:
-                params = GAParams(args, self._cap, self._ttarget)
+                params = self.params(args)
             except LookupError as e:
                 log.error(f"{e}")
                 return "ERR NOT_SET"
             except Exception as e:
                 log.error(f"Could not get GA params: {e}")
                 return "ERR PARSE_FAIL"
-            inner_product = (v*params.target_states).sum()
+            inner_product = fidelity(v, params.target_states).mean()
+            metrics.FIDELITY.labels(self.name).set(float(inner_product))
+        self._record(self._vlast, None if args is None else inner_product, m)
 
-        if maintain and inner_product < params.fidelity:
-            try:
-                p_history, f_history, iter = await self.gradient_ascent(
-                    target_states=params.target_states,
-                    target_pols=None,
-                    max_iterations=params.iters,
-                    threshold=(1-params.fidelity),
-                    paramsi=None,
-                    channels=[1, 1, 1, 1])
-            except Exception as e:
-                log.error(f"Could not complete GA: {e}")
-                return f"ERR {e}"
-            log.info(f"[Maintain] Current f: {f_history[-1]}")
-            ret = f"OK {f_history[-1]}"
+        diverged = maintain and self._track_drift(m)
+        if diverged:
+            log.info(f"[Maintain] Drift model diverged, nis: {self.kf.nis:.1f}")
+        if maintain and (inner_product < params.fidelity or diverged):
+            self.kf.reset()
+            # evaluations of the Jacobian correction and the GA fallback
+            self._evals = 0
+            with trace(self._trace_path(params), name=f"M {self.name}",
+                       f=float(inner_product)):
+                if not diverged:
+                    with span("jacobian"):
+                        f = await self._jacobian_correct(params)
+                    if f is not None and f >= params.fidelity:
+                        log.info(f"[Maintain] Jacobian correction, f: {f}, "
+                                 f"evals: {self._evals}")
+                        return Reply(f"OK {f} evals={self._evals}", f, evals=self._evals)
+                try:
+                    p_history, f_history, iter = await self.gradient_ascent(
+                        target_states=params.target_states,
+                        target_pols=None,
+                        max_iterations=params.iters,
+                        threshold=(1-params.fidelity),
+                        paramsi=None,
+                        channels=[1, 1, 1, 1],
+                        optimizer=params.optimizer)
+                except Exception as e:
+                    log.error(f"Could not complete GA: {e}")
+                    return f"ERR {e}"
+            log.info(f"[Maintain] Current f: {f_history[-1]}, evals: {self._evals}")
+            ret = Reply(f"OK {f_history[-1]} evals={self._evals}", f_history[-1],
+                        evals=self._evals)
         elif maintain:
-            log.info(f"[Maintain] Current f: {inner_product}")
-            ret = f"OK {inner_product}"
+            f = await self._feed_forward(params, inner_product)
+            if f is not None:
+                inner_product = f
+            drift = float(np.linalg.norm(self.kf.velocity)) if self.kf.ready else None
+            log.info(f"[Maintain] Current f: {inner_product}, drift: {drift}")
+            ret = Reply(f"OK {inner_product}", inner_product, drift=drift)
         else:
             log.info(f"Stokes: {v}, f = {inner_product}")
-            ret = f"OK {inner_product}"
+            ret = Reply(f"OK {inner_product}", None if args is None else inner_product,
+                        stokes=v)
         return ret
 
     async def _handle_ga(self, cmd, args, pinit=None):
@@ -159,217 +317,626 @@ class PolarizationControl:
             log.error("No SOP arguments provided")
             return "ERR NO_ARGS"
         try:
-            params = GAParams(args, self._cap, self._ttarget)
+            params = self.params(args)
         except LookupError as e:
             log.error(f"{e}")
             return "ERR NOT_SET"
         except Exception as e:
             log.error(f"Could not get GA params: {e}")
             return "ERR PARSE_FAIL"
+        self._evals = 0
         try:
-            p_history, f_history, iter = await self.gradient_ascent(
-                target_states=params.target_states,
-                target_pols=None,
-                max_iterations=params.iters,
-                threshold=(1-params.fidelity),
-                paramsi=pinit,
-                channels=[1, 1, 1, 1])
+            with trace(self._trace_path(params), name=f"S {self.name}"):
+                p_history, f_history, iter = await self.gradient_ascent(
+                    target_states=params.target_states,
+                    target_pols=None,
+                    max_iterations=params.iters,
+                    threshold=(1-params.fidelity),
+                    paramsi=pinit,
+                    channels=[1, 1, 1, 1],
+                    optimizer=params.optimizer)
         except Exception as e:
             log.error(f"Could not complete GA: {e}")
             return f"ERR {e}"
-        result = float(f_history[-1][0].real)
-        log.info(f"Result: {result}")
-        return f"OK {result}"
+        result = float(f_history[-1])
+        log.info(f"Result: {result}, evals: {self._evals}")
+        return Reply(f"OK {result} evals={self._evals}", result, evals=self._evals)
+
+    async def _handle_abort(self, cmd, args):
+        # Stops the running calibration (already preempted by this command),
+        # drops queued ones and leaves the maintain mode
+        dropped = self.rq.drop(PREEMPTIBLE_CMDS)
+        for entry in dropped:
+            for reply in entry["replies"]:
+                if not reply.done():
+                    reply.set_result("ERR ABORTED")
+        n = len(dropped) + (self._preempted or self._prevcmd == CMD.MAINTAIN)
+        self._preempted = False
+        log.info(f"Aborted {n} calibrations")
+        return Reply(f"OK {n}", n)
+
+    async def _preemptible(self, coro):
+        # Runs a calibration as a task. Queued duplicates of the running
+        # command join its reply, a more urgent command stops it at its
+        # next evaluation.
+        task = asyncio.create_task(coro)
+        self._preempted = False
+        try:
+            while not self._preempt:
+                waiter = asyncio.create_task(self.rq.wait(PRIO_PREEMPT))
+                try:
+                    await asyncio.wait((task, waiter), return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    waiter.cancel()
+                if task.done():
+                    break
+                self._replies += self.rq.take(self._curcmd, self._curargs)
+                self._preempt = self.rq.pending(PRIO_PREEMPT)
+            return await task
+        except Preempted:
+            log.info(f"{self._curcmd} {self._curargs} preempted at {self._resume}")
+            metrics.PREEMPTIONS.labels(self.name, self._curcmd).inc()
+            self._preempted = True
+            return "ERR PREEMPTED"
+        finally:
+            self._preempt = False
+            if not task.done():
+                task.cancel()
 
     async def _handle_capture(self, cmd, args):
+        # Averages up to N SOPs, one per polarimeter dataset, and stops
+        # early once the confidence radius of the mean is below tol. Fails
+        # if no new dataset arrives within CAP_TIMEOUT.
         samples = DEF_CAP_SAMPLES
+        tol = None
         if args:
             try:
                 samples = int(args[0])
+                tol = float(args[1]) if len(args) > 1 else None
+                if samples < 1 or (tol is not None and not tol > 0):
+                    raise ValueError("N must be at least 1 and tol positive")
             except Exception as e:
                 log.error(f"Invalid args: {e}")
-                return self._cap
-        log.info(f"Capturing {samples} SOPs...")
-        ary = np.array([0j, 0j, 0j])
-        for i in range(1, samples+1):
-            v = np.array(self.pax.stoke_vectors())
-            log.info(f"{i}: {v}")
-            ary += v
-            await asyncio.sleep(0.01)
-            time.sleep(DEF_CAP_SAMPLE_SLEEP)
-        ary /= samples
+                return "ERR PARSE_FAIL"
+        log.info(f"Capturing up to {samples} SOPs, tolerance {tol}...")
+        stats = StokesStats()
+        ts = None
+        taken = 0
+        deadline = time.monotonic() + CAP_TIMEOUT
+        while taken < samples:
+            m = await self.pax_io.snapshot(max_age=0)
+            # the polarimeter repeats its latest dataset until the next one
+            if m.timestamp == ts:
+                if time.monotonic() > deadline:
+                    log.error(f"No new polarimeter dataset in {CAP_TIMEOUT}s")
+                    return "ERR TIMEOUT"
+                await asyncio.sleep(CAP_POLL)
+                continue
+            ts = m.timestamp
+            deadline = time.monotonic() + CAP_TIMEOUT
+            taken += 1
+            self._record(self._vlast, None, m)
+            stats.add(m.stokes, m.DOP)
+            log.debug(f"{stats.n}: {m.stokes}, DOP {m.DOP}")
+            if tol is not None and stats.n >= CAP_MIN_SAMPLES and stats.radius < tol:
+                break
+        ary = stats.mean
         self._cap = ary
-        log.info(f"Mean SOP after {samples} readings: {ary}")
-        return f"OK {ary}"
+        log.info(f"Mean SOP after {stats.n} readings: {ary}, spread {stats.spread:.4g}, "
+                 f"radius {stats.radius:.4g}")
+        return Reply(f"OK {ary} n={stats.n} spread={stats.spread:.4g}", ary,
+                     n=stats.n, spread=stats.spread, radius=stats.radius, cov=stats.cov)
 
     async def _loop(self):
+        cmd, args, change = self._curcmd, self._curargs, False
+        jitter = metrics.LOOP_JITTER.labels(self.name)
+        deadline = None
         while True:
-            log.info(f"({self._curcmd}) Polarimeter power: {self.pax.total_power()}")
-            cmd, args, change = await self._get_cmd()
+            tick = time.monotonic()
+            # wake-up lateness of a timer driven measurement tick
+            if deadline is not None and not change:
+                jitter.observe(max(0, tick - deadline))
+            # one snapshot per tick, _handle_meas reuses it from the cache
+            m = await self.pax_io.snapshot()
+            log.info(f"({self._curcmd}) Polarimeter power: {m.Ptotal}")
             if cmd == CMD.MEAS:
                 ret = await self._handle_meas(cmd, args)
             elif cmd == CMD.SET:
-                ret = await self._handle_ga(cmd, args)
+                ret = await self._preemptible(self._handle_ga(cmd, args))
+                if isinstance(ret, Reply):
+                    self._last_set = args
                 self._reset_cmd()
             elif cmd == CMD.CAPTURE:
                 ret = await self._handle_capture(cmd, args)
                 self._prev_cmd()
             elif cmd == CMD.MAINTAIN:
-                ret = await self._handle_meas(cmd, args, maintain=True)
+                if change:
+                    self.kf.reset()
+                ret = await self._preemptible(self._handle_meas(cmd, args, maintain=True))
             elif cmd == CMD.TFORM:
                 ret = await self._handle_transform(cmd, args)
                 self._prev_cmd()
             elif cmd == CMD.GET:
                 ret = await self._handle_get(cmd, args)
                 self._prev_cmd()
+            elif cmd == CMD.ABORT:
+                ret = await self._handle_abort(cmd, args)
+                self._reset_cmd()
             else:
                 log.error(f"Unknown command: {cmd}")
                 ret = "ERR UNKNOWN_CMD"
                 self._prev_cmd()
-            if change:
-                await sq.put(f"{ret}")
-            await asyncio.sleep(1)
+            for reply in self._replies:
+                if not reply.done():
+                    reply.set_result(ret if isinstance(ret, str) else f"{ret}")
+            self._replies = []
+            # wake up on the next command or the next measurement tick
+            interval = self.interval
+            if self._curcmd == CMD.MEAS and self.idle_interval is not None:
+                interval = self.idle_interval
+            timeout = max(0, interval - (time.monotonic() - tick))
+            # only a plain measurement tick that finished in time schedules
+            # the next one, commands and overruns are not loop jitter
+            plain = cmd == CMD.MEAS and not change and timeout > 0
+            deadline = tick + interval if plain else None
+            cmd, args, change = await self._get_cmd(timeout)
+
+    async def _jacobian_correct(self, params, channels=[1]*NCHAN):
+        # Follow a small drift with computed voltage steps from the local
+        # Jacobian model, returns the fidelity reached or None if the model
+        # is not usable yet
+        if self._vlast is None:
+            return None
+        # Probe the voltage directions the model has not seen enough of
+        for d in self.jac.unexplored(channels):
+            p = np.clip(self._vlast + JACOBIAN_PROBE*d, -EPC_VMAX, EPC_VMAX)
+            await self.read_inner(p, params.target_states, None)
+        f = None
+        for i in range(JACOBIAN_STEPS):
+            dv = self.jac.solve(params.target_states, channels)
+            p = np.clip(self._vlast + dv, -EPC_VMAX, EPC_VMAX)
+            f = await self.read_inner(p, params.target_states, None)
+            log.debug(f"Jacobian step {i+1}: {np.round(dv)}, f = {f}")
+            if f >= params.fidelity:
+                self._phist = p
+                break
+        return f
+
+    def _track_drift(self, m):
+        # Feeds a measurement to the drift filter. Returns True once the
+        # filter has stopped explaining the measurements.
+        if self.kf.ready and not np.array_equal(self._vlast, self._kf_v):
+            # the voltages moved, the drift estimate carries over small steps
+            if (self._kf_v is None or
+                    np.linalg.norm(self._vlast - self._kf_v) > JACOBIAN_REACH):
+                self.kf.reset()
+            else:
+                self.kf.rebase(m.time, m.stokes)
+        if self.kf.ready and self.kf.t == m.time:
+            nis = 0.0
+        else:
+            nis = self.kf.update(m.time, m.stokes)
+        self._kf_v = None if self._vlast is None else self._vlast.copy()
+        self._kf_outliers = self._kf_outliers + 1 if nis > KALMAN_GATE else 0
+        return self._kf_outliers >= KALMAN_ESCALATE
 
-    def _rand_params(self, channels=[1]*NCHAN):
-        p = (np.random.rand(4) - 0.5) * 9900
-        for i, v in enumerate(channels):
-            p[i] = 0 if not v else p[i]
-        return p
+    async def _feed_forward(self, params, f_cur):
+        # Steers the SOP predicted for the next tick onto the target with a
+        # small Jacobian step, once the predicted infidelity uses up part of
+        # the margin. A step that lowers the fidelity below f_cur is undone
+        # (the model has learned from it). Returns the fidelity after the
+        # step or None.
+        if not self.kf.ready or not self.jac.ready or self._vlast is None:
+            return None
+        s = self.kf.forecast(self.interval)
+        f_pred = fidelity(s, params.target_states).mean()
+        if 1 - f_pred < KALMAN_DEADBAND*(1 - params.fidelity):
+            return None
+        self._evals = 0
+        v0 = self._vlast
+        dv = self.jac.solve(params.target_states, s=s)
+        p = np.clip(v0 + dv, -EPC_VMAX, EPC_VMAX)
+        f = await self.read_inner(p, params.target_states, None)
+        if f < f_cur:
+            f = await self.read_inner(v0, params.target_states, None)
+        # the settled measurement of the step is still cached
+        self._track_drift(await self.pax_io.snapshot())
+        log.debug(f"[Maintain] feed-forward {np.round(dv)}, predicted f: {f_pred}, f: {f}")
+        return f
+
+    def seeder(self, channels=[1]*NCHAN):
+        return QuasiRandomSeeder(channels, rng=self.rng)
 
     async def gradient_ascent(self, target_states=[Hstate], target_pols=[], max_iterations=400,
-                              threshold=0.01, paramsi=None, channels=[1]*NCHAN):
+                              threshold=0.01, paramsi=None, channels=[1]*NCHAN,
+                              optimizer=DEF_OPTIMIZER):
+        # Evaluations add to self._evals, which the caller resets at the
+        # start of a correction
+        evals0 = self._evals
+        self._evals_to_fidelity = None
+        start = time.monotonic()
+        traffic = self.epc.counters()
+        # Starting points to try before the random search: the given
+        # params, else stored solutions for nearby targets and the last result
         if paramsi is not None:
-            params0 = paramsi
-            log.debug(f"Initial params: {params0}")
-        elif self._phist is not None:
-            params0 = self._phist
+            candidates = [paramsi]
+            log.debug(f"Initial params: {paramsi}")
         else:
-            params0 = self._rand_params(channels=channels)
-        log.info(f"Checking random search for initial threshold {DEF_GA_RAND_THRESH}")
-        attempts = DEF_GA_RAND_ITERS
-        while True:
-            inner_curr = self.read_inner(params0, target_states, target_pols)
-            log.info(f"f = {inner_curr}")
-            log.debug(f"targets: {target_states}")
-            log.debug(f"params0: {params0}")
-            if inner_curr > DEF_GA_RAND_THRESH:
-                break
-            params0 = self._rand_params(channels=channels)
-            attempts -= 1
-            if not attempts:
-                raise Exception("Random search failure")
-        # Set gradient step, initialize parameters and history
-        grad_step = STEP
+            candidates = self.warm.lookup(target_states, k=WARMSTART_K)
+            log.info(f"Warm start candidates: {len(candidates)}")
+            # a preempted calibration continues from where it stopped
+            if self._resume is not None:
+                candidates.insert(0, self._resume)
+                self._resume = None
+            if self._phist is not None:
+                candidates.append(self._phist)
+        # followed by a quasi-random sweep, keeping the best point if none
+        # reaches the threshold
+        candidates.extend(self.seeder(channels).points(DEF_GA_RAND_ITERS, start=self._vlast))
+        log.info(f"Checking seed search for initial threshold {DEF_GA_RAND_THRESH}")
+        params0, inner_curr = None, None
+        with span("seed", candidates=len(candidates)) as sp:
+            for i, params in enumerate(candidates):
+                inner = await self.read_inner(params, target_states, target_pols)
+                log.info(f"f = {inner}")
+                log.debug(f"targets: {target_states}")
+                log.debug(f"params: {params}")
+                if inner_curr is None or inner > inner_curr:
+                    params0, inner_curr = params, inner
+                if inner > DEF_GA_RAND_THRESH:
+                    break
+            sp.set(evals=self._evals - evals0, f=float(inner_curr))
+        self._seed_evals = self._evals - evals0
+        log.info(f"Seed search: {self._seed_evals} evaluations, f = {inner_curr}")
+        # Initialize optimizer, parameters and history
+        opt = get_optimizer(optimizer,
+                            lambda p: self.read_inner(p, target_states, target_pols),
+                            channels=channels)
         p = params0.copy()
-        pgrad = params0.copy()
-        p_history = p
-        f_history = inner_curr
-        diff = 1.0e10  # 1
-        log.info("Starting GA search...")
+        opt.start(p, inner_curr)
+        p_history = np.empty((max_iterations+1, NCHAN))
+        f_history = np.empty(max_iterations+1)
+        p_history[0] = p
+        f_history[0] = inner_curr
+        n = 1
+        diff = np.absolute(inner_curr - 1)
+        log.info(f"Starting {opt.name} search...")
         for iters in range(max_iterations):
             if diff < threshold:
                 break
-            gchange = False
-            while not gchange:
-                for i, v in enumerate(channels):
-                    if v and np.random.rand() > 0.5:
-                        pgrad[i] += grad_step
-                        gchange = True
-            (pgrad, inner_curr) = self.grad_func(p, pgrad, target_states, target_pols,
-                                                 LEARNING_RATE, inner_curr)
-            p = pgrad.copy()
+            with span(f"{opt.name}.step", iter=iters+1) as sp:
+                (p, inner_curr) = await opt.step(p, inner_curr)
+                sp.set(f=float(inner_curr))
+            p = p.copy()
             p[p > 5000] = 0
             p[p < -5000] = 0
-            p_history = np.vstack((p_history, p))
-            f_history = np.vstack((f_history, inner_curr))
-            log.info(f"Iter {iters+1}, f = {float(f_history[-1][0].real)} - {np.round(p)}")
-            diff = np.absolute(f_history[-1] - 1)
-            await asyncio.sleep(0.01)
+            p_history[n] = p
+            f_history[n] = inner_curr
+            n += 1
+            log.info(f"Iter {iters+1}, f = {f_history[n-1]} - {np.round(p)}")
+            diff = np.absolute(f_history[n-1] - 1)
+        labels = (self.name, opt.name)
+        if diff < threshold:
+            self._evals_to_fidelity = self._evals
+            self.warm.record(target_states, p_history[n-1], f_history[n-1])
+            metrics.GA_TIME_TO_FIDELITY.labels(*labels).observe(time.monotonic() - start)
+        metrics.GA_RUNS.labels(*labels, "converged" if diff < threshold else "failed").inc()
+        metrics.GA_EVALUATIONS.labels(*labels).observe(self._evals - evals0)
+        metrics.GA_ITERATIONS.labels(*labels).observe(n - 1)
+        log.info(f"{opt.name}: {self._evals - evals0} evaluations, "
+                 f"evaluations to fidelity: {self._evals_to_fidelity}")
+        traffic = {k: v - traffic[k] for k, v in self.epc.counters().items()}
+        log.info(f"EPC traffic: {traffic}")
+        p_history = p_history[:n]
+        f_history = f_history[:n]
         self._phist = p_history[-1]
-        return p_history, f_history, iters+1
+        return p_history, f_history, n
+
+    async def read_inner(self, params, target_states, input_pols):
+        # checkpoint of preemptible calibrations
+        if self._preempt:
+            self._resume = None if self._vlast is None else self._vlast.copy()
+            raise Preempted()
+        self._evals += 1
+        metrics.EVALUATIONS.labels(self.name).inc()
+        with span("read_inner", eval=self._evals) as sp:
+            if input_pols:
+                return await self._read_inner_pols(params, target_states, input_pols)
+            # The SOP does not depend on the target, so one write and one
+            # measurement serve all of them
+            m = await self._write_measure(params)
+            inner_products = fidelity(m.stokes, target_states)
+            log.debug(f"\tinner: {inner_products}")
+            f = inner_products.mean()
+            metrics.FIDELITY.labels(self.name).set(float(f))
+            self._record(params, f, m)
+            sp.set(f=float(f))
+            return f
 
-    def read_inner(self, params, target_states, input_pols):
+    async def _read_inner_pols(self, params, target_states, input_pols):
+        # Each target is measured with its own input polarization, so this
+        # path needs one EPC write and measurement per target
         ret_f = 0
         nstates = len(target_states)
         for i, tstate in enumerate(target_states):
-            for ch in range(len(params)):
-                self.epc.write_v(ch+1, params[ch])
-            time.sleep(EPC_SLEEP_TIME)
+            m = await self._write_measure(params)
             # calculate inner product by normalized Stokes vector, format is (S1, S2, S3)
-            inner_product = (np.array(self.pax.stoke_vectors())*tstate).sum()
+            inner_product = m.stokes @ tstate
             log.debug(f"\tinner ({tstate.tolist()}): {inner_product}")
             ret_f += inner_product/nstates
+        self._record(params, ret_f, m)
         return ret_f
 
-    def grad_func(self, params0, params1, target_states, input_pols, learning_rate, inner_prev=None):
-        if not inner_prev:
-            inner_prev = self.read_inner(params0, target_states, input_pols)
-        inner_adv = self.read_inner(params1, target_states, input_pols)
-        # since calculating gradient is the most expensive operation here,
-        # we will advance the state directly while calculating inner product
-        # cost function is given by the deviation of inner product and 1
-        delta_p = -(params1 - params0) * (abs(1 - inner_adv) -
-                                          abs(1 - inner_prev)) * learning_rate
-        if (inner_adv - inner_prev) < 0:
-            params0 += delta_p
-            inner_curr = self.read_inner(params0, target_states, input_pols)
-            return (params0, inner_curr)  # if inner product decreases, advance from the previous direction
+    def _record(self, v, f, m):
+        # Keeps fidelity measurements in the history and sends every
+        # measurement to the telemetry subscribers. G SOP answers with the
+        # latest one, also while a calibration is running.
+        self._sop = m.stokes
+        t = time.time()
+        if v is not None and f is not None:
+            self.history.append(t, v, f, m.stokes)
+        if len(self.telemetry):
+            self.telemetry.publish({
+                "t": t,
+                "link": self.name,
+                "revs": m.revs,
+                "stokes": m.stokes.tolist(),
+                "f": None if f is None else float(f),
+                "dop": m.DOP,
+                "power": m.Ptotal,
+                "v": None if v is None else np.asarray(v, dtype=float).tolist()})
+
+    async def _write_measure(self, params):
+        if self._vlast is None:
+            step = EPC_VMAX
         else:
-            params1 += delta_p
-            inner_curr = self.read_inner(params1, target_states, input_pols)
-            return (params1, inner_curr)  # if inner product increases, advance directly
+            step = np.max(np.abs(np.asarray(params) - self._vlast))
+        await self.epc_io.write_vs(params)
+        self._vlast = np.array(params, dtype=float)
+        start = time.monotonic()
+        with span("settle", step=float(step)):
+            m = await self.settle.wait(step)
+        metrics.SETTLE_SECONDS.labels(self.name).observe(time.monotonic() - start)
+        self.jac.update(params, m.stokes)
+        return m
 
 
 # This method implements the socket server.
-# It writes received commands from the network into a queue
-async def PolControlProtocol(reader, writer):
+# It writes received commands from the network into the queue of the
+# addressed link. Commands may be prefixed by @<link id>, otherwise they go
+# to the first link. A connection starts in text mode and may switch to
+# line-delimited JSON requests with "PROTO JSON" (JSON replies) or
+# "PROTO BIN" (framed replies and packed telemetry), where requests carry
+# an id and are handled concurrently.
+async def PolControlProtocol(reader, writer, links):
+    wlock = asyncio.Lock()
+    mode = PROTO_TEXT
+    # link id -> (subscription, streaming task) of this connection
+    subs = dict()
+    tasks = set()
+
+    async def _send(data):
+        async with wlock:
+            writer.write(data)
+            await writer.drain()
+
     async def _write(val):
-        val += "\n"
-        writer.write(bytes(val, "utf-8"))
-        await writer.drain()
-
-    async def _try_lock(lock, attempts=2):
-        while attempts:
-            if lock.locked():
-                await asyncio.sleep(1)
-                attempts -= 1
+        await _send(bytes(val + "\n", "utf-8"))
+
+    async def _reply(req_id, reply):
+        if mode == PROTO_TEXT:
+            await _write(reply)
+        elif mode == PROTO_JSON:
+            await _send(encode_json(reply_dict(req_id, reply)))
+        else:
+            await _send(encode_frame(FRAME_REPLY, encode_json(reply_dict(req_id, reply))))
+
+    async def _stream(sub, req_id):
+        while True:
+            record = await sub.get()
+            if mode == PROTO_TEXT:
+                await _write(f"DATA {json.dumps(record)}")
+            elif mode == PROTO_JSON:
+                await _send(encode_json({"id": req_id, "data": record}))
             else:
-                return True
-        return False
-
-    while True:
-        data = await reader.read(MAX_BUFLEN)
-        if not data:
-            break
-        if not await _try_lock(lock):
-            await _write("ERR BUSY")
-            continue
-        await lock.acquire()
+                await _send(encode_frame(FRAME_TELEMETRY, pack_telemetry(req_id, record)))
+
+    def _unsubscribe(pctl):
+        if pctl.name in subs:
+            sub, task = subs.pop(pctl.name)
+            task.cancel()
+            pctl.telemetry.unsubscribe(sub)
+
+    def _handle_watch(pctl, args, req_id):
+        try:
+            decimation = int(args[0]) if args else 1
+        except ValueError:
+            return "ERR PARSE_FAIL"
+        if mode == PROTO_BIN and not valid_telemetry_id(req_id):
+            log.error(f"Watch request id {req_id!r} does not fit a telemetry frame")
+            return "ERR PARSE_FAIL"
+        _unsubscribe(pctl)
+        if decimation > 0:
+            sub = pctl.telemetry.subscribe(decimation)
+            subs[pctl.name] = (sub, asyncio.create_task(_stream(sub, req_id)))
+        return Reply(f"OK {decimation}", decimation)
+
+    async def _dispatch(link, cmd, args, req_id=0):
+        pctl = links.get(link) if link is not None else default
+        if pctl is None:
+            return "ERR UNKNOWN_LINK"
+        if not cmd:
+            return "ERR NO_CMD"
+        if cmd == CMD.WATCH:
+            return _handle_watch(pctl, args, req_id)
+        elif cmd in READONLY_CMDS:
+            return await pctl.handle_readonly(cmd, args)
+        return await pctl.submit(cmd, args)
+
+    async def _handle_request(line):
+        req_id = 0
         try:
-            msg = data.decode().strip().split(" ")
-            cmd = msg[0]
-            args = msg[1:] if len(msg) > 1 else None
-            await rq.put({"cmd": cmd, "args": args})
-            await _write(await sq.get())
+            req = json.loads(line)
+            req_id = req.get("id", 0)
+            args = [str(a) for a in req.get("args") or []] or None
+            reply = await _dispatch(req.get("link"), req.get("cmd"), args, req_id)
         except Exception as e:
-            log.error(f"Error processing request: {data}: {e}")
-        lock.release()
+            log.error(f"Error processing request: {line}: {e}")
+            reply = "ERR PARSE_FAIL"
+        await _reply(req_id, reply)
+
+    default = next(iter(links.values()))
+    try:
+        # only text mode commands may end without a newline
+        async for line in read_lines(reader, lambda: FRAME_IDLE if mode == PROTO_TEXT else None):
+            line = line.decode().strip()
+            if not line:
+                continue
+            if mode != PROTO_TEXT:
+                task = asyncio.create_task(_handle_request(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                continue
+            try:
+                msg = line.split(" ")
+                link = None
+                if msg[0].startswith("@"):
+                    link = msg[0][1:]
+                    msg = msg[1:]
+                cmd = msg[0] if msg else None
+                args = msg[1:] if len(msg) > 1 else None
+                if cmd == CMD.PROTO:
+                    proto = args[0].upper() if args else None
+                    if proto not in PROTOS:
+                        await _write("ERR UNKNOWN_ARGS")
+                        continue
+                    await _write(f"OK {proto}")
+                    mode = proto
+                    continue
+                await _write(await _dispatch(link, cmd, args))
+            except Exception as e:
+                log.error(f"Error processing request: {line}: {e}")
+    except ValueError as e:
+        log.error(f"Closing connection: {e}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        for pctl in links.values():
+            _unsubscribe(pctl)
+        writer.close()
 
 
-async def run(pctl, host, port):
-    server = await asyncio.start_server(PolControlProtocol, host, port)
-    asyncio.create_task(pctl._loop())
+async def run(links, host, port, metrics_port=None):
+    server = await asyncio.start_server(
+        functools.partial(PolControlProtocol, links=links), host, port)
+    if metrics_port:
+        await metrics.serve_metrics(host, metrics_port)
+    for pctl in links.values():
+        asyncio.create_task(pctl._loop())
+        if pctl.scheduler is not None:
+            asyncio.create_task(pctl.scheduler.run())
     await server.serve_forever()
 
 
+# Link specification ID[,EPC_PORT[,PAX_RESOURCE]]
+def parse_link(spec):
+    fields = spec.split(",")
+    link = {"id": fields[0], "port": EPC_PORT, "device": PAX_RESOURCE}
+    if len(fields) > 1 and fields[1]:
+        link["port"] = fields[1]
+    if len(fields) > 2 and fields[2]:
+        link["device"] = fields[2]
+    return link
+
+
 def main():
+    parser = argparse.ArgumentParser(description="M-node polarization control")
+    parser.add_argument("pinit", nargs="?", help="initial EPC voltages as V1,V2,V3,V4")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--backend", choices=list(BACKENDS), default="hw",
+                        help="device backend, 'sim' runs against an emulated bench, "
+                             "'replay' answers from a recorded trace")
+    parser.add_argument("--epc-port", default=EPC_PORT)
+    parser.add_argument("--pax-resource", default=PAX_RESOURCE)
+    parser.add_argument("--interval", type=float, default=MEAS_INTERVAL,
+                        help="seconds between polarimeter measurements while idle")
+    parser.add_argument("--link", action="append", type=parse_link, default=None,
+                        help="control several links, ID[,EPC_PORT[,PAX_RESOURCE]], "
+                             "may be repeated")
+    parser.add_argument("--sim-drift", type=float, default=0.0,
+                        help="simulated fiber random walk in rad/sqrt(s)")
+    parser.add_argument("--sim-seed", type=int, default=None)
+    parser.add_argument("--history-file", default=None,
+                        help="append every evaluation to this file (float64 rows of "
+                             "timestamp, V1..V4, fidelity, S1..S3)")
+    parser.add_argument("--warmstart-file", default=None,
+                        help="persist converged solutions used to seed calibration here")
+    parser.add_argument("--record-trace", default=None,
+                        help="record every EPC write and polarimeter reading to this file")
+    parser.add_argument("--replay-trace", default=None,
+                        help="trace file answering the 'replay' backend")
+    parser.add_argument("--replay-speed", type=float, default=1.0,
+                        help="trace seconds replayed per second")
+    parser.add_argument("--trace-dir", default=None,
+                        help="write the trace= files of Set and Maintain here, "
+                             "tracing is off without it")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics over HTTP on this port")
+    parser.add_argument("--recal", nargs="?", const="", default=None, metavar="ARGS",
+                        help="recalibrate idle links when their drift is predicted to take "
+                             "the fidelity below the threshold, to the Set arguments ARGS "
+                             "(e.g. 'C 0.999'), by default to the last Set of the link")
+    parser.add_argument("--quiet", action="append", type=parse_quiet, default=[],
+                        metavar="[ID@]HH:MM-HH:MM",
+                        help="no scheduled recalibration of link ID (default all links) "
+                             "in this local time window, may be repeated")
+    args = parser.parse_args()
     try:
-        pinit = sys.argv[1]
-        pinit = np.array(list(map(float, pinit.split(","))))
+        pinit = np.array(list(map(float, args.pinit.split(","))))
     except Exception:
         pinit = None
-    p = PolarizationControl(pinit)
-    asyncio.run(main(p, '127.0.0.1', 6000))
+    links = args.link
+    if not links:
+        links = [{"id": "0", "port": args.epc_port, "device": args.pax_resource}]
+    multi = len(links) > 1
+    if args.backend == "replay" and not args.replay_trace:
+        parser.error("the replay backend needs --replay-trace")
+    pctls = dict()
+    for i, link in enumerate(links):
+        if link["id"] in pctls:
+            parser.error(f"duplicate link id {link['id']}")
+        # per link files get the link id appended
+        hfile, wfile = args.history_file, args.warmstart_file
+        tfile, rfile = args.record_trace, args.replay_trace
+        if multi:
+            hfile = hfile and f"{hfile}.{link['id']}"
+            wfile = wfile and f"{wfile}.{link['id']}"
+            tfile = tfile and f"{tfile}.{link['id']}"
+            rfile = rfile and f"{rfile}.{link['id']}"
+        if args.backend == "hw":
+            epc, pax = open_devices("hw", port=link["port"], device=link["device"],
+                                    trace=tfile)
+        elif args.backend == "replay":
+            epc, pax = open_devices("replay", path=rfile, speed=args.replay_speed,
+                                    trace=tfile)
+        else:
+            seed = None if args.sim_seed is None else args.sim_seed + i
+            epc, pax = open_devices(args.backend, drift=args.sim_drift, seed=seed,
+                                    trace=tfile)
+        pctls[link["id"]] = PolarizationControl(pinit, epc=epc, pax=pax,
+                                                history=History(path=hfile),
+                                                warm=WarmStartIndex(path=wfile),
+                                                name=link["id"], interval=args.interval,
+                                                trace_dir=args.trace_dir)
+        if args.recal is not None:
+            pctls[link["id"]].scheduler = RecalScheduler(
+                pctls[link["id"]], args=args.recal.split() or None,
+                quiet=[q for q in args.quiet if q[0] in (None, link["id"])])
+    for q in args.quiet:
+        if q[0] is not None and q[0] not in pctls:
+            parser.error(f"quiet window for unknown link {q[0]}")
+    asyncio.run(run(pctls, args.host, args.port, args.metrics_port))
 
 
 if __name__ == '__main__':
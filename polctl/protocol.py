@@ -0,0 +1,106 @@
+import json
+import struct
+import asyncio
+import numpy as np
+from polctl.constants import (
+    MAX_BUFLEN,
+    MAX_LINELEN,
+    FRAME_IDLE
+)
+
+# Connection modes, negotiated with "PROTO <mode>" as the first command
+PROTO_TEXT = "TEXT"
+PROTO_JSON = "JSON"
+PROTO_BIN = "BIN"
+PROTOS = (PROTO_TEXT, PROTO_JSON, PROTO_BIN)
+
+# Binary mode frames are a 1 byte type and 4 byte payload length, followed
+# by the payload: a JSON reply or a packed telemetry record
+FRAME_HEADER = struct.Struct("<BI")
+FRAME_REPLY = 1
+FRAME_TELEMETRY = 2
+# request id, timestamp, revs, S1, S2, S3, fidelity, DOP, power, V1..V4
+# (NaN for a missing fidelity or voltages)
+TELEMETRY_RECORD = struct.Struct("<IdI3d3d4d")
+
+
+def _plain(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class Reply(str):
+    # The text reply of a command that also carries its value and fields
+    # for the framed protocol modes
+    def __new__(cls, text, value=None, **fields):
+        obj = super().__new__(cls, text)
+        obj.value = value
+        obj.fields = fields
+        return obj
+
+
+def reply_dict(req_id, reply):
+    reply = str(reply) if not isinstance(reply, Reply) else reply
+    ok = reply.startswith("OK")
+    d = {"id": req_id, "ok": ok}
+    if isinstance(reply, Reply):
+        d["result"] = _plain(reply.value)
+        d.update({k: _plain(v) for k, v in reply.fields.items()})
+    elif ok:
+        d["result"] = reply[3:]
+    else:
+        d["error"] = reply[4:] if reply.startswith("ERR ") else reply
+    return d
+
+
+def encode_json(obj):
+    return (json.dumps(obj) + "\n").encode()
+
+
+def encode_frame(ftype, payload):
+    return FRAME_HEADER.pack(ftype, len(payload)) + payload
+
+
+def valid_telemetry_id(req_id):
+    # packed telemetry carries the request id as an unsigned 32 bit int
+    return isinstance(req_id, int) and 0 <= req_id < 2**32
+
+
+def pack_telemetry(req_id, record):
+    f = record["f"]
+    v = record["v"] or [float("nan")]*4
+    return TELEMETRY_RECORD.pack(req_id, record["t"], record["revs"], *record["stokes"],
+                                 float("nan") if f is None else f,
+                                 record["dop"], record["power"], *v)
+
+
+async def read_lines(reader, idle=FRAME_IDLE):
+    # Yields newline terminated commands. Older clients send a single
+    # command without a newline and wait for the reply, so a partial line
+    # followed by idle seconds of silence also counts as complete. idle may
+    # be a function returning the current value, None waits for the
+    # newline (the framed modes).
+    buf = b""
+    while True:
+        if b"\n" in buf:
+            line, buf = buf.split(b"\n", 1)
+            yield line
+            continue
+        timeout = idle() if callable(idle) else idle
+        try:
+            data = await asyncio.wait_for(reader.read(MAX_BUFLEN),
+                                          None if not buf else timeout)
+        except asyncio.TimeoutError:
+            line, buf = buf, b""
+            yield line
+            continue
+        if not data:
+            if buf.strip() and timeout is not None:
+                yield buf
+            return
+        buf += data
+        if len(buf) > MAX_LINELEN and b"\n" not in buf:
+            raise ValueError("Command too long")
@@ -0,0 +1,192 @@
+import os
+import time
+import atexit
+import logging
+import threading
+import numpy as np
+from polctl.sim import EPCModel, SimSerial, SimInstrument
+from polctl.sop import stokes, normalize
+from polctl.constants import (
+    NCHAN,
+    TRACE_FLUSH,
+    REPLAY_WINDOW,
+    REPLAY_K,
+    SIM_PAX_LATENCY,
+    SIM_PAX_REV_RATE
+)
+
+log = logging.getLogger(__name__)
+
+# A trace file holds raw float64 rows of TRACE_COLS values:
+#   timestamp, TRACE_VOLTS, V1..Vn            after each EPC write
+#   timestamp, TRACE_MEAS, revs, theta, eta, DOP, Ptotal, pax timestamp
+#                                             for each SENS:DATA:LAT? reply
+TRACE_COLS = 8
+TRACE_VOLTS = 0
+TRACE_MEAS = 1
+
+
+class TraceRecorder(object):
+    # Appends timestamped EPC voltages and polarimeter records to a trace
+    # file, shared by the serial and VISA taps of one link
+    def __init__(self, path, nchan=NCHAN):
+        self.path = path
+        self.nchan = nchan
+        self._fh = open(path, "ab")
+        self._lock = threading.Lock()
+        self._unflushed = 0
+        self.records = 0
+        atexit.register(self.close)
+
+    def _write(self, kind, values):
+        row = np.full(TRACE_COLS, np.nan)
+        row[0] = time.time()
+        row[1] = kind
+        row[2:2+len(values)] = values
+        with self._lock:
+            if self._fh is None:
+                return
+            self._fh.write(row.tobytes())
+            self.records += 1
+            self._unflushed += 1
+            if self._unflushed >= TRACE_FLUSH:
+                self._fh.flush()
+                self._unflushed = 0
+
+    def voltages(self, v):
+        self._write(TRACE_VOLTS, v)
+
+    def measurement(self, raw):
+        li = raw.strip().split(",")
+        self._write(TRACE_MEAS, [float(li[0]), float(li[9]), float(li[10]), float(li[11]),
+                                 float(li[12]), float(li[1])])
+
+    def close(self):
+        with self._lock:
+            if self._fh:
+                self._fh.close()
+                self._fh = None
+
+
+class SerialTap(object):
+    # Wraps the EPC serial port and records the voltage vector after every
+    # write that sets a channel. Voltages not set yet are NaN.
+    def __init__(self, ser, recorder):
+        self.ser = ser
+        self.recorder = recorder
+        self._v = np.full(recorder.nchan, np.nan)
+
+    def write(self, data):
+        changed = False
+        for line in bytes(data).decode(errors="ignore").splitlines():
+            line = line.strip()
+            if line.startswith("V") and "," in line:
+                try:
+                    ch, value = line[1:].split(",")
+                    self._v[int(ch)-1] = float(value)
+                    changed = True
+                except (ValueError, IndexError):
+                    pass
+        ret = self.ser.write(data)
+        if changed:
+            self.recorder.voltages(self._v)
+        return ret
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+
+class InstrumentTap(object):
+    # Wraps the polarimeter VISA resource and records every measurement
+    def __init__(self, inst, recorder):
+        self.inst = inst
+        self.recorder = recorder
+
+    def query(self, cmd):
+        ret = self.inst.query(cmd)
+        if cmd == "SENS:DATA:LAT?":
+            try:
+                self.recorder.measurement(ret)
+            except (ValueError, IndexError) as e:
+                log.error(f"Could not record measurement {ret!r}: {e}")
+        return ret
+
+    def __getattr__(self, name):
+        return getattr(self.inst, name)
+
+
+def load_trace(path):
+    if not os.path.getsize(path):
+        return np.zeros((0, TRACE_COLS))
+    rows = np.fromfile(path, dtype=np.float64).reshape(-1, TRACE_COLS)
+    return rows[np.argsort(rows[:, 0], kind="stable")]
+
+
+def settled_samples(rows, nchan=NCHAN):
+    # (timestamp, voltages, Stokes vector, DOP, power) of the measurements
+    # taken at known, settled voltages: the last measurement before the
+    # next EPC write, the one the controller used
+    volts = rows[rows[:, 1] == TRACE_VOLTS]
+    meas = rows[rows[:, 1] == TRACE_MEAS]
+    if not len(volts) or not len(meas):
+        return np.zeros(0), np.zeros((0, nchan)), np.zeros((0, 3)), np.zeros(0), np.zeros(0)
+    i = np.searchsorted(volts[:, 0], meas[:, 0], side="right") - 1
+    keep = i >= 0
+    keep[:-1] &= i[1:] != i[:-1]
+    v = volts[np.maximum(i, 0), 2:2+nchan]
+    keep &= ~np.any(np.isnan(v), axis=1)
+    m = meas[keep]
+    return m[:, 0], v[keep], stokes(m[:, 3], m[:, 4]), m[:, 5], m[:, 6]
+
+
+class ReplayBench(object):
+    # Answers the simulated EPC and polarimeter from a recorded trace. The
+    # replay clock runs speed times faster through the trace time, and the
+    # SOP at the commanded voltages is the most recent recorded sample at
+    # those voltages, else the inverse distance weighted mean of the k
+    # recorded samples with the nearest voltages within window seconds of
+    # trace time (the most recent of equally near ones). Without noise the
+    # replay is deterministic.
+    def __init__(self, path, speed=1.0, window=REPLAY_WINDOW, k=REPLAY_K,
+                 latency=SIM_PAX_LATENCY, rev_rate=SIM_PAX_REV_RATE, clock=time.monotonic):
+        self.t, self.v, self.s, self.dop, self.p = settled_samples(load_trace(path))
+        if not len(self.t):
+            raise ValueError(f"No settled measurements in trace {path}")
+        log.info(f"Replaying {len(self.t)} samples over {self.t[-1] - self.t[0]:.1f}s "
+                 f"from {path}")
+        self.speed = speed
+        self.window = window
+        self.k = k
+        self.clock = clock
+        self.latency = latency
+        self.rev_rate = rev_rate
+        self.noise = 0.0
+        self.power = float(np.median(self.p))
+        self.noise_seed = 0
+        self.epc = EPCModel(tau=0, clock=clock)
+        self.start = clock()
+
+    def trace_time(self, now=None):
+        now = self.clock() if now is None else now
+        return min(self.t[0] + (now - self.start)*self.speed, self.t[-1])
+
+    def sop(self, now=None):
+        now = self.clock() if now is None else now
+        tt = self.trace_time(now)
+        lo, hi = np.searchsorted(self.t, (tt - self.window, tt + self.window))
+        if hi - lo < self.k:
+            lo, hi = 0, len(self.t)
+        d = np.linalg.norm(self.v[lo:hi] - self.epc.voltages(now), axis=1)
+        idx = np.lexsort((-self.t[lo:hi], d))[:self.k]
+        # voltages are whole numbers, at recorded voltages the reading
+        # taken there is replayed as is
+        if d[idx[0]] < 1.0:
+            return self.s[lo + idx[0]]
+        w = 1/d[idx]
+        return normalize(w @ self.s[lo + idx])
+
+    def serial(self):
+        return SimSerial(self)
+
+    def instrument(self):
+        return SimInstrument(self)
@@ -0,0 +1,161 @@
+import math
+import time
+import asyncio
+import logging
+import datetime
+import numpy as np
+from polctl import metrics
+from polctl.kalman import DriftFilter
+from polctl.sop import normalize, fidelity
+from polctl.constants import (
+    CMD,
+    KALMAN_GATE,
+    KALMAN_ESCALATE,
+    SCHED_MIN,
+    SCHED_MAX,
+    SCHED_SAFETY,
+    SCHED_SAMPLES,
+    SCHED_MIN_UPDATES,
+    SCHED_GRID,
+    SCHED_Q
+)
+
+log = logging.getLogger(__name__)
+
+
+# Quiet window [LINK@]HH:MM-HH:MM in local time, may wrap past midnight.
+# Returns (link id or None for all links, start minute, end minute).
+def parse_quiet(spec):
+    link, _, window = spec.rpartition("@")
+    start, _, end = window.partition("-")
+
+    def minute(hhmm):
+        h, m = hhmm.split(":")
+        if not (0 <= int(h) < 24 and 0 <= int(m) < 60):
+            raise ValueError(f"invalid time {hhmm}")
+        return int(h)*60 + int(m)
+
+    return link or None, minute(start), minute(end)
+
+
+def in_window(window, now=None):
+    now = datetime.datetime.now() if now is None else now
+    _, start, end = window
+    t = now.hour*60 + now.minute
+    if start <= end:
+        return start <= t < end
+    return t >= start or t < end
+
+
+class RecalScheduler(object):
+    # Recalibrates an idle link when the SOP drift measured from its
+    # telemetry stream predicts the fidelity to fall below the threshold
+    # before the next check. The target is args of a Set command, by
+    # default the link's last Set. The check interval follows the
+    # predicted time left (safety times it, within min_interval and
+    # max_interval) and the idle loop measures samples times per check.
+    # Recalibrations due inside a quiet window wait until it ends.
+    def __init__(self, pctl, args=None, quiet=(), min_interval=SCHED_MIN,
+                 max_interval=SCHED_MAX, safety=SCHED_SAFETY, samples=SCHED_SAMPLES):
+        self.pctl = pctl
+        self.args = args
+        self.quiet = list(quiet)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.safety = safety
+        self.samples = samples
+        self.kf = DriftFilter(q=SCHED_Q)
+        self._v = None
+        self._updates = 0
+        self._outliers = 0
+        self.interval = min_interval
+        self.recalibrations = 0
+        metrics.RECAL_INTERVAL.labels(pctl.name).set_function(lambda: self.interval)
+
+    def _reset(self):
+        self.kf.reset()
+        self._updates = 0
+        self._outliers = 0
+
+    def feed(self, record):
+        # Drift is only measured while the voltages stay put
+        v = record["v"]
+        if v != self._v:
+            self._reset()
+            self._v = v
+        nis = self.kf.update(record["t"], record["stokes"])
+        self._updates += 1
+        self._outliers = self._outliers + 1 if nis > KALMAN_GATE else 0
+        if self._outliers >= KALMAN_ESCALATE:
+            # the SOP jumped, measure the drift from here
+            self._reset()
+            self.kf.update(record["t"], record["stokes"])
+            self._updates = 1
+
+    def time_left(self, target_states, threshold, now=None):
+        # Seconds until the predicted fidelity falls below threshold, inf
+        # beyond the horizon of the longest check interval
+        now = time.time() if now is None else now
+        horizon = self.max_interval/self.safety
+        dt = (now - self.kf.t) + np.concatenate(([0], np.geomspace(0.1, horizon, SCHED_GRID)))
+        s = normalize(self.kf.position + dt[:, None]*self.kf.velocity)
+        f = fidelity(s, target_states).mean(axis=1)
+        below = np.flatnonzero(f < threshold)
+        return math.inf if not len(below) else max(0.0, dt[below[0]] - (now - self.kf.t))
+
+    def quiet_now(self, now=None):
+        return any(in_window(w, now) for w in self.quiet)
+
+    def _params(self):
+        args = self.args if self.args is not None else self.pctl.last_set
+        if not args:
+            return None, None
+        try:
+            return args, self.pctl.params(args)
+        except Exception as e:
+            log.error(f"[Recal] Invalid target {args}: {e}")
+            return None, None
+
+    async def check(self):
+        # Returns the next check interval
+        if self.pctl.busy:
+            # calibrating or maintaining, the link takes care of itself
+            return self.min_interval
+        args, params = self._params()
+        if params is None or not self.kf.ready or self._updates < SCHED_MIN_UPDATES:
+            return self.min_interval
+        t_left = self.time_left(params.target_states, params.fidelity)
+        drift = float(np.linalg.norm(self.kf.velocity))
+        log.info(f"[Recal] drift {drift:.3g}/s, fidelity {params.fidelity} "
+                 f"predicted to last {t_left:.1f}s")
+        if t_left > self.min_interval:
+            return min(self.max_interval, max(self.min_interval, self.safety*t_left))
+        if self.quiet_now():
+            log.info("[Recal] Recalibration due, deferred by quiet window")
+            metrics.RECALIBRATIONS.labels(self.pctl.name, "deferred").inc()
+            return self.min_interval
+        log.info(f"[Recal] Recalibrating to {args}")
+        metrics.RECALIBRATIONS.labels(self.pctl.name, "run").inc()
+        self.recalibrations += 1
+        ret = await self.pctl.submit(CMD.SET, list(args))
+        log.info(f"[Recal] {ret}")
+        return self.min_interval
+
+    async def run(self):
+        sub = self.pctl.telemetry.subscribe()
+        try:
+            while True:
+                self.pctl.idle_interval = self.interval/self.samples
+                deadline = time.monotonic() + self.interval
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        self.feed(await asyncio.wait_for(sub.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+                self.interval = await self.check()
+        finally:
+            self.pctl.telemetry.unsubscribe(sub)
+            self.pctl.idle_interval = None
@@ -0,0 +1,58 @@
+import numpy as np
+from polctl.constants import (
+    NCHAN,
+    SEED_RANGE
+)
+
+PRIMES = (2, 3, 5, 7, 11, 13)
+
+
+# Van der Corput radical inverse of the integers in idx in the given base
+def radical_inverse(idx, base):
+    idx = np.array(idx, dtype=np.int64)
+    inv = np.zeros(idx.shape)
+    f = 1.0 / base
+    while np.any(idx > 0):
+        inv += f * (idx % base)
+        idx //= base
+        f /= base
+    return inv
+
+
+# n points of the Halton sequence in [0, 1)^dims, starting at index start
+def halton(n, dims, start=1):
+    idx = np.arange(start, start + n)
+    return np.stack([radical_inverse(idx, PRIMES[d]) for d in range(dims)], axis=1)
+
+
+# Orders points so that each one is the nearest unvisited one to the
+# previous, by the largest channel change since that bounds the EPC settle
+def min_motion_order(points, start):
+    todo = list(range(len(points)))
+    order = list()
+    cur = np.asarray(start, dtype=float)
+    while todo:
+        d = np.max(np.abs(points[todo] - cur), axis=1)
+        j = todo.pop(int(np.argmin(d)))
+        order.append(j)
+        cur = points[j]
+    return points[order]
+
+
+class QuasiRandomSeeder(object):
+    # Low-discrepancy coarse sweep over the enabled channels. The Halton
+    # points are randomly shifted (Cranley-Patterson) so each sweep covers
+    # the space evenly without repeating the previous one, and are visited
+    # in minimal motion order from the current voltages.
+    def __init__(self, channels=[1]*NCHAN, vrange=SEED_RANGE, rng=None):
+        self.channels = np.array(channels, dtype=bool)
+        self.vrange = vrange
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    def points(self, n, start=None):
+        dims = int(self.channels.sum())
+        u = (halton(n, dims) + self.rng.random(dims)) % 1.0
+        p = np.zeros((n, NCHAN))
+        p[:, self.channels] = (2*u - 1) * self.vrange
+        start = np.zeros(NCHAN) if start is None else start
+        return min_motion_order(p, start)
@@ -0,0 +1,86 @@
+import math
+import time
+import asyncio
+import logging
+import numpy as np
+from polctl import metrics
+from polctl.constants import (
+    STEP,
+    EPC_SLEEP_TIME,
+    SETTLE_TOL,
+    SETTLE_NSTABLE,
+    SETTLE_POLL,
+    SETTLE_MIN,
+    SETTLE_ALPHA,
+    SETTLE_PREDICT_FRAC
+)
+
+
+log = logging.getLogger(__name__)
+
+
+class SettleEngine(object):
+    # Waits for the SOP to settle after an EPC voltage step. Polls the
+    # polarimeter and returns as soon as nstable consecutive readings from
+    # new datasets agree within tol, or once max_wait has passed.
+    # Observed settle times are learned per step size bucket (powers of two
+    # of STEP) and the predicted part of the wait is slept through without
+    # polling.
+    def __init__(self, pax_io, tol=SETTLE_TOL, nstable=SETTLE_NSTABLE, poll=SETTLE_POLL,
+                 min_wait=SETTLE_MIN, max_wait=EPC_SLEEP_TIME, alpha=SETTLE_ALPHA):
+        self.pax_io = pax_io
+        self.tol = tol
+        self.nstable = nstable
+        self.poll = poll
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.alpha = alpha
+        self._model = dict()
+
+    @staticmethod
+    def _bucket(step):
+        if step < STEP:
+            return 0
+        return int(math.log2(step/STEP)) + 1
+
+    def predict(self, step):
+        return self._model.get(self._bucket(step))
+
+    def _learn(self, step, elapsed):
+        b = self._bucket(step)
+        prev = self._model.get(b)
+        self._model[b] = elapsed if prev is None else prev + self.alpha*(elapsed - prev)
+
+    async def wait(self, step, start=None):
+        # Returns the first settled measurement. start is the time of the
+        # EPC write, defaults to now.
+        start = time.monotonic() if start is None else start
+        if not self.max_wait:
+            return await self.pax_io.snapshot(max_age=0)
+        pred = self.predict(step)
+        delay = self.min_wait if pred is None else max(self.min_wait, pred*SETTLE_PREDICT_FRAC)
+        await asyncio.sleep(max(0, min(delay, self.max_wait) - (time.monotonic() - start)))
+        prev = None
+        ts = None
+        stable = 0
+        while True:
+            m = await self.pax_io.snapshot(max_age=0)
+            elapsed = time.monotonic() - start
+            # the polarimeter repeats its latest dataset until the next one
+            if m.timestamp != ts:
+                ts = m.timestamp
+                s = m.stokes
+                if prev is not None and np.linalg.norm(s - prev) < self.tol:
+                    stable += 1
+                else:
+                    stable = 0
+                prev = s
+                if stable >= self.nstable:
+                    break
+            if elapsed >= self.max_wait:
+                metrics.SETTLE_TIMEOUTS.labels(self.pax_io.link).inc()
+                break
+            await asyncio.sleep(self.poll)
+        self._learn(step, elapsed)
+        log.debug(f"settled in {elapsed:.3f}s for step {step:.0f}")
+        return m
@@ -0,0 +1,231 @@
+import math
+import time
+import threading
+import numpy as np
+from polctl.constants import (
+    NCHAN,
+    EPC_VMAX,
+    PAX_IDN,
+    WAVELENGTH,
+    SIM_EPC_VPI,
+    SIM_EPC_TAU,
+    SIM_PAX_REV_RATE,
+    SIM_PAX_LATENCY,
+    SIM_PAX_NOISE,
+    SIM_PAX_POWER,
+    Hstate
+)
+from polctl.sop import rotation_matrices
+
+
+# Rotation of the Poincare sphere about an axis by angle (Rodrigues)
+def rotation(axis, angle):
+    return rotation_matrices(axis, angle)
+
+
+def random_rotation(rng):
+    axis = rng.normal(size=3)
+    return rotation(axis, rng.uniform(0, np.pi))
+
+
+class Fiber(object):
+    # Birefringent fiber whose SOP transformation wanders over time.
+    # drift is a random walk strength in rad/sqrt(s), rate a constant
+    # rotation speed in rad/s about a fixed random axis.
+    def __init__(self, drift=0.0, rate=0.0, rng=None, clock=time.monotonic):
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.drift = drift
+        self.rate = rate
+        self.clock = clock
+        self.R = random_rotation(self.rng)
+        self._axis = self.rng.normal(size=3)
+        self._t = clock()
+        self._lock = threading.Lock()
+
+    def rotation(self, now=None):
+        now = self.clock() if now is None else now
+        with self._lock:
+            dt = now - self._t
+            if dt > 0:
+                if self.drift:
+                    w = self.rng.normal(scale=self.drift*math.sqrt(dt), size=3)
+                    self.R = rotation(w, np.linalg.norm(w)) @ self.R
+                if self.rate:
+                    self.R = rotation(self._axis, self.rate*dt) @ self.R
+                self._t = now
+            return self.R
+
+
+class EPCModel(object):
+    # OZ Optics EPC-400: four fiber squeezers with alternating 0/45 degree
+    # axes. Each channel's retardance is linear in its drive voltage and
+    # follows a commanded step with a first order response of time tau.
+    AXES = (0, np.pi/4, 0, np.pi/4)
+
+    def __init__(self, vpi=SIM_EPC_VPI, tau=SIM_EPC_TAU, clock=time.monotonic):
+        self.vpi = vpi
+        self.tau = tau
+        self.clock = clock
+        self._start = np.zeros(NCHAN)
+        self._target = np.zeros(NCHAN)
+        self._t0 = np.zeros(NCHAN)
+        self._lock = threading.Lock()
+
+    def set(self, ch, value, now=None):
+        now = self.clock() if now is None else now
+        value = max(-EPC_VMAX, min(EPC_VMAX, int(value)))
+        with self._lock:
+            i = ch - 1
+            self._start[i] = self._voltages(now)[i]
+            self._target[i] = value
+            self._t0[i] = now
+
+    def _voltages(self, now):
+        if not self.tau:
+            return self._target.copy()
+        dt = np.maximum(now - self._t0, 0)
+        return self._target + (self._start - self._target)*np.exp(-dt/self.tau)
+
+    def voltages(self, now=None):
+        now = self.clock() if now is None else now
+        with self._lock:
+            return self._voltages(now)
+
+    def rotation(self, now=None):
+        # waveplates in order, the first one is applied first
+        a = 2*np.asarray(self.AXES)
+        axes = np.stack((np.cos(a), np.sin(a), np.zeros_like(a)), axis=1)
+        Rs = rotation_matrices(axes, np.pi*self.voltages(now)/self.vpi)
+        return np.linalg.multi_dot(list(Rs[::-1]))
+
+
+class SimBench(object):
+    # Light source -> input fiber -> EPC -> drifting link fiber -> polarimeter
+    def __init__(self, drift=0.0, rate=0.0, noise=SIM_PAX_NOISE, latency=SIM_PAX_LATENCY,
+                 rev_rate=SIM_PAX_REV_RATE, tau=SIM_EPC_TAU, vpi=SIM_EPC_VPI,
+                 power=SIM_PAX_POWER, sin=Hstate, seed=None, clock=time.monotonic):
+        self.rng = np.random.default_rng(seed)
+        self.clock = clock
+        self.noise = noise
+        self.latency = latency
+        self.rev_rate = rev_rate
+        self.power = power
+        self.sin = np.asarray(sin, dtype=float)
+        self.fiber_in = random_rotation(self.rng)
+        self.fiber = Fiber(drift=drift, rate=rate, rng=self.rng, clock=clock)
+        self.epc = EPCModel(vpi=vpi, tau=tau, clock=clock)
+        # measurement noise is seeded per dataset, see SimInstrument
+        self.noise_seed = int(self.rng.integers(2**32))
+        self.start = clock()
+
+    def sop(self, now=None):
+        now = self.clock() if now is None else now
+        return self.fiber.rotation(now) @ self.epc.rotation(now) @ self.fiber_in @ self.sin
+
+    def serial(self):
+        return SimSerial(self)
+
+    def instrument(self):
+        return SimInstrument(self)
+
+
+class SimSerial(object):
+    # Stands in for the pyserial port of the EPC-400
+    def __init__(self, bench, timeout=1):
+        self.bench = bench
+        self.timeout = timeout
+        self._rbuf = bytearray()
+        self._wbuf = bytearray()
+        self._lock = threading.Condition()
+
+    def write(self, data):
+        with self._lock:
+            self._wbuf += data
+            while b"\n" in self._wbuf:
+                line, _, rest = self._wbuf.partition(b"\n")
+                self._wbuf = bytearray(rest)
+                self._rbuf += self._handle(line.decode().strip())
+            self._lock.notify_all()
+        return len(data)
+
+    def _handle(self, cmd):
+        if cmd.startswith("V") and "," in cmd:
+            try:
+                ch, value = cmd[1:].split(",")
+                ch = int(ch)
+                if not 1 <= ch <= NCHAN:
+                    raise ValueError(ch)
+                self.bench.epc.set(ch, int(value))
+            except ValueError:
+                return b"Error\r\n"
+        return b"Done\r\n"
+
+    def read(self, size=1):
+        with self._lock:
+            data = bytes(self._rbuf[:size])
+            del self._rbuf[:size]
+        return data
+
+    def readline(self):
+        with self._lock:
+            self._lock.wait_for(lambda: b"\n" in self._rbuf, timeout=self.timeout)
+            i = self._rbuf.find(b"\n") + 1
+            data = bytes(self._rbuf[:i])
+            del self._rbuf[:i]
+        return data
+
+    @property
+    def in_waiting(self):
+        return len(self._rbuf)
+
+    def close(self):
+        pass
+
+
+class SimInstrument(object):
+    # Stands in for the pyvisa resource of the PAX1000. Like the real
+    # polarimeter it holds the latest dataset, repeated queries within
+    # one dataset return the same record.
+    def __init__(self, bench):
+        self.bench = bench
+        self.wavelength = WAVELENGTH
+        self._dataset = None
+        self._record = None
+
+    def write(self, cmd):
+        for c in cmd.split(";"):
+            c = c.strip().lstrip(":")
+            if c.startswith("SENS:CORR:WAV "):
+                self.wavelength = float(c.split(" ")[1])
+
+    def query(self, cmd):
+        if self.bench.latency:
+            time.sleep(self.bench.latency)
+        if cmd == "*IDN?":
+            return PAX_IDN
+        elif cmd == "SENS:CORR:WAV?":
+            return f"{self.wavelength:e}"
+        elif cmd == "SENS:DATA:LAT?":
+            return self._latest()
+        return ""
+
+    def _latest(self):
+        b = self.bench
+        now = b.clock()
+        # one dataset is taken every two revolutions (SENS:CALC 9)
+        revs = int((now - b.start)*b.rev_rate)
+        revs -= revs % 2
+        if revs == self._dataset:
+            return self._record
+        ts = b.start + revs/b.rev_rate
+        s = b.sop(max(ts, b.start))
+        rng = np.random.default_rng([b.noise_seed, revs//2])
+        theta = 0.5*math.atan2(s[1], s[0]) + rng.normal(scale=b.noise)
+        eta = 0.5*math.asin(max(-1.0, min(1.0, s[2]))) + rng.normal(scale=b.noise)
+        dop = 1 - abs(rng.normal(scale=b.noise))
+        ptotal = b.power*(1 + rng.normal(scale=b.noise))
+        fields = [revs, int((ts - b.start)*1000), 9, 0, 1, 0.01, 0.95,
+                  1/b.rev_rate, 0, theta, eta, dop, ptotal]
+        self._dataset = revs
+        self._record = ",".join(str(f) for f in fields)
+        return self._record
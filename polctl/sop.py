@@ -1,39 +1,81 @@
 import numpy as np
 
 
-# Rotation matrix which rotates an intial vector v about an axis at an angle theta
-# The axis is defined by the crossproduct between the vector v and vector 1,0,0
-# If v and 1,0,0 are linear dependent, then axis is defined by crossproduct between v and 0,1,0
-def rotation_matrix(v, theta, normalize=False):
-    if normalize:
-        v_normalized = v / np.linalg.norm(v)
-    else:
-        v_normalized = v
-    axis = np.cross(v_normalized, [1, 0, 0])
+# All functions work on real Stokes vectors (S1, S2, S3) and broadcast
+# over leading dimensions, e.g. an (N x 3) stack of vectors with N angles.
+
+
+# Unit Stokes vectors along the last axis
+def normalize(v):
+    v = np.asarray(v, dtype=float)
+    n = np.linalg.norm(v, axis=-1, keepdims=True)
+    return np.divide(v, n, out=np.zeros_like(v), where=n > 0)
+
+
+# Normalized Stokes vectors of polarization ellipse azimuth psi and
+# ellipticity chi in radians
+def stokes(psi, chi):
+    psi = np.asarray(psi, dtype=float)
+    chi = np.asarray(chi, dtype=float)
+    return np.stack((np.cos(2*psi)*np.cos(2*chi),
+                     np.sin(2*psi)*np.cos(2*chi),
+                     np.sin(2*chi)), axis=-1)
+
+
+# Inner products of Stokes vectors v (3 or N x 3) with each row of an
+# (M x 3) stack of targets, shape (M,) or (N x M)
+def fidelity(v, targets):
+    return np.asarray(v, dtype=float) @ np.atleast_2d(np.asarray(targets, dtype=float)).T
+
+
+# Rotation matrices (... x 3 x 3) of the Poincare sphere about axes by
+# angles in radians (Rodrigues), axes need not be normalized
+def rotation_matrices(axes, angles):
+    k = normalize(axes)
+    angles = np.asarray(angles, dtype=float)
+    k, angles = np.broadcast_arrays(k, angles[..., None])
+    angles = angles[..., 0]
+    K = np.zeros(k.shape + (3,))
+    K[..., 0, 1], K[..., 0, 2] = -k[..., 2], k[..., 1]
+    K[..., 1, 0], K[..., 1, 2] = k[..., 2], -k[..., 0]
+    K[..., 2, 0], K[..., 2, 1] = -k[..., 1], k[..., 0]
+    c = np.cos(angles)[..., None, None]
+    s = np.sin(angles)[..., None, None]
+    return np.eye(3) + s*K + (1 - c)*(K @ K)
+
+
+# Rotates Stokes vectors v about axes by angles in radians (Rodrigues)
+def rotate(v, axes, angles):
+    v = np.asarray(v, dtype=float)
+    k = normalize(axes)
+    angles = np.asarray(angles, dtype=float)[..., None]
+    c, s = np.cos(angles), np.sin(angles)
+    return v*c + np.cross(k, v)*s + k*np.sum(k*v, axis=-1, keepdims=True)*(1 - c)
+
+
+# Axis used to transform v, perpendicular to v and 1,0,0, or to 0,1,0 if
+# v and 1,0,0 are linear dependent
+def _transform_axis(v):
+    axis = np.cross(v, [1, 0, 0])
     if np.allclose(axis, [0, 0, 0]):
-        axis = np.cross(v_normalized, [0, 1, 0])
+        axis = np.cross(v, [0, 1, 0])
+    return axis
 
-    angle = np.deg2rad(theta)
-    cos_theta = np.cos(angle)
-    sin_theta = np.sin(angle)
-    ux, uy, uz = axis
-    rotation_matrix = np.array([
-        [cos_theta + ux**2 * (1 - cos_theta), ux*uy*(1 - cos_theta) - uz*sin_theta,
-         ux*uz*(1 - cos_theta) + uy*sin_theta],
-        [uy*ux*(1 - cos_theta) + uz*sin_theta, cos_theta + uy**2*(1 - cos_theta),
-         uy*uz*(1 - cos_theta) - ux*sin_theta],
-        [uz*ux*(1 - cos_theta) - uy*sin_theta, uz*uy*(1 - cos_theta) + ux*sin_theta,
-         cos_theta + uz**2*(1 - cos_theta)]
-    ])
 
-    return rotation_matrix
+# Rotation matrix which rotates an intial vector v about an axis at an angle theta
+# in degrees, theta may be an array of angles. The axis is normalized, so
+# normalize only matters for transform().
+def rotation_matrix(v, theta, normalize=False):
+    return rotation_matrices(_transform_axis(np.asarray(v, dtype=float)), np.deg2rad(theta))
 
 
+# v rotated by each angle theta in degrees, theta 180 gives the antipodal SOP
 def transform(v, theta, normalize=False):
-    v_anti = np.dot(rotation_matrix(v, theta, normalize), v)
+    v = np.asarray(v, dtype=float)
+    v_rot = rotate(v, _transform_axis(v), np.deg2rad(theta))
     if normalize:
-        return v_anti / np.linalg.norm(v_anti)
-    return v_anti
+        return v_rot / np.linalg.norm(v_rot, axis=-1, keepdims=True)
+    return v_rot
 
 
 if __name__ == "__main__":
@@ -54,14 +96,8 @@ if __name__ == "__main__":
     print("Antipodal vector", v_antipodal)
     print("Antipodal vector normalized", v_antipodal / np.linalg.norm(v_antipodal))
 
-    # Calculate rotated vectors
+    # Calculate rotated vectors, one row per angle
     num_steps = 7
-    rotated_vectors = []
-
     angle_values = np.linspace(0, 180, num_steps)
-
-    for i in angle_values:
-        v_rotated = transform(v, i, normalize=True)
-        # v_rotated /= np.linalg.norm(v_rotated)
-        rotated_vectors.append(v_rotated)
+    rotated_vectors = transform(v, angle_values, normalize=True)
     print(rotated_vectors)
@@ -0,0 +1,54 @@
+import asyncio
+import collections
+from polctl.constants import SUB_QUEUE_LEN
+
+
+class Subscription(object):
+    # Bounded queue of telemetry records for one subscriber. Every
+    # decimation-th record is kept, when the subscriber falls behind the
+    # oldest records are dropped.
+    def __init__(self, decimation=1, maxlen=SUB_QUEUE_LEN):
+        self.decimation = max(1, int(decimation))
+        self.dropped = 0
+        self._queue = collections.deque(maxlen=maxlen)
+        self._event = asyncio.Event()
+        self._count = 0
+
+    def put(self, record):
+        self._count += 1
+        if (self._count - 1) % self.decimation:
+            return
+        dropped = len(self._queue) == self._queue.maxlen
+        self.dropped += dropped
+        self._queue.append(record)
+        self._event.set()
+        return dropped
+
+    async def get(self):
+        while not self._queue:
+            self._event.clear()
+            await self._event.wait()
+        return self._queue.popleft()
+
+
+class Publisher(object):
+    # Fans out telemetry records to any number of subscriptions, dropped
+    # counts the records lost by all subscriptions so far
+    def __init__(self):
+        self._subs = set()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._subs)
+
+    def subscribe(self, decimation=1, maxlen=SUB_QUEUE_LEN):
+        sub = Subscription(decimation, maxlen)
+        self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        self._subs.discard(sub)
+
+    def publish(self, record):
+        for sub in self._subs:
+            self.dropped += sub.put(record)
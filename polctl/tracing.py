@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import logging
+import contextvars
+
+log = logging.getLogger(__name__)
+
+# Tracer of the command being handled, None when tracing is off
+_current = contextvars.ContextVar("polctl_tracer", default=None)
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span(object):
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.add(self.name, self._start, end, self.args)
+        return False
+
+    def set(self, **args):
+        self.args.update(args)
+
+
+class Tracer(object):
+    # Collects complete ("X") events of nested spans and writes them as a
+    # Chrome trace / Perfetto JSON file. Nesting follows from the event
+    # times, all spans of one command run on the same task.
+    def __init__(self, path, name="polctl"):
+        self.path = path
+        self.name = name
+        self.events = list()
+        self._t0 = time.perf_counter()
+        self._pid = os.getpid()
+
+    def add(self, name, start, end, args):
+        self.events.append({"name": name, "ph": "X", "pid": self._pid, "tid": 0,
+                            "ts": (start - self._t0)*1e6, "dur": (end - start)*1e6,
+                            "args": args})
+
+    def save(self):
+        meta = [{"name": "thread_name", "ph": "M", "pid": self._pid, "tid": 0,
+                 "args": {"name": self.name}}]
+        with open(self.path, "w") as fh:
+            json.dump({"traceEvents": meta + self.events, "displayTimeUnit": "ms"}, fh)
+        log.info(f"Wrote {len(self.events)} trace events to {self.path}")
+
+
+def span(name, **args):
+    # Times the enclosed block if the current command is traced
+    tracer = _current.get()
+    if tracer is None:
+        return _NULL_SPAN
+    return Span(tracer, name, args)
+
+
+class trace(object):
+    # Traces the enclosed block into path, does nothing without a path
+    def __init__(self, path, name="polctl", **args):
+        self.path = path
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        if not self.path:
+            return _NULL_SPAN
+        self._tracer = Tracer(self.path, self.name)
+        self._token = _current.set(self._tracer)
+        self._span = Span(self._tracer, self.name, self.args).__enter__()
+        return self._span
+
+    def __exit__(self, *exc):
+        if not self.path:
+            return False
+        self._span.__exit__(*exc)
+        _current.reset(self._token)
+        try:
+            self._tracer.save()
+        except Exception as e:
+            log.error(f"Could not write trace {self.path}: {e}")
+        return False
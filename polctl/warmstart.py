@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import logging
+import numpy as np
+from polctl.constants import (
+    NCHAN,
+    WARMSTART_CAPACITY,
+    WARMSTART_MAX_AGE,
+    WARMSTART_MAX_DIST,
+    WARMSTART_MERGE_DIST
+)
+
+
+log = logging.getLogger(__name__)
+
+
+# Point on the Poincare sphere that best matches a set of targets,
+# the normalized mean of their Stokes vectors
+def target_key(target_states):
+    t = np.mean(np.asarray(target_states, dtype=float), axis=0)
+    return t / np.linalg.norm(t)
+
+
+class WarmStartIndex(object):
+    # Converged (target SOP, voltages, fidelity, timestamp) solutions,
+    # optionally persisted to a JSON file. lookup() returns the voltages of
+    # the solutions nearest to a target on the Poincare sphere. Entries
+    # older than max_age are evicted, as is the oldest entry when over
+    # capacity.
+    def __init__(self, path=None, capacity=WARMSTART_CAPACITY, max_age=WARMSTART_MAX_AGE,
+                 max_dist=WARMSTART_MAX_DIST):
+        self.path = path
+        self.capacity = capacity
+        self.max_age = max_age
+        self.max_dist = max_dist
+        self._targets = np.zeros((0, 3))
+        self._volts = np.zeros((0, NCHAN))
+        self._fid = np.zeros(0)
+        self._ts = np.zeros(0)
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self._fid)
+
+    def record(self, target_states, v, f, t=None):
+        t = time.time() if t is None else t
+        key = target_key(target_states)
+        # a solution for (nearly) the same target replaces the old one
+        if len(self):
+            dist = np.arccos(np.clip(self._targets @ key, -1, 1))
+            self._keep(dist > WARMSTART_MERGE_DIST)
+        self._targets = np.vstack((self._targets, key))
+        self._volts = np.vstack((self._volts, np.asarray(v, dtype=float)))
+        self._fid = np.append(self._fid, f)
+        self._ts = np.append(self._ts, t)
+        self._evict(t)
+        if self.path:
+            self.save()
+
+    def lookup(self, target_states, k=1, now=None):
+        now = time.time() if now is None else now
+        self._evict(now)
+        if not len(self):
+            return list()
+        key = target_key(target_states)
+        dist = np.arccos(np.clip(self._targets @ key, -1, 1))
+        order = [i for i in np.argsort(dist)[:k] if dist[i] <= self.max_dist]
+        return [self._volts[i].copy() for i in order]
+
+    def _keep(self, mask):
+        self._targets = self._targets[mask]
+        self._volts = self._volts[mask]
+        self._fid = self._fid[mask]
+        self._ts = self._ts[mask]
+
+    def _evict(self, now):
+        if self.max_age:
+            self._keep(now - self._ts <= self.max_age)
+        if len(self) > self.capacity:
+            self._keep(np.argsort(np.argsort(-self._ts)) < self.capacity)
+
+    def save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as fh:
+            json.dump({"targets": self._targets.tolist(),
+                       "volts": self._volts.tolist(),
+                       "fidelity": self._fid.tolist(),
+                       "timestamp": self._ts.tolist()}, fh)
+        os.replace(tmp, self.path)
+
+    def load(self):
+        try:
+            with open(self.path) as fh:
+                d = json.load(fh)
+            self._targets = np.array(d["targets"], dtype=float).reshape(-1, 3)
+            self._volts = np.array(d["volts"], dtype=float).reshape(-1, NCHAN)
+            self._fid = np.array(d["fidelity"], dtype=float)
+            self._ts = np.array(d["timestamp"], dtype=float)
+        except Exception as e:
+            log.error(f"Could not load warm start index {self.path}: {e}")
@@ -61,6 +61,9 @@ with open("README.md", "r") as fh:
             entry_points={
                 'console_scripts': [
                     'pol_ctl = polctl.pol_ctl:main',
+                    'pol_client = polctl.client:main',
+                    'pol_loadgen = polctl.loadgen:main',
+                    'pol_bench = polctl.bench:main',
                 ]
             }
         )
@@ -0,0 +1,38 @@
+import numpy as np
+from polctl.capture import StokesStats
+
+
+def test_unweighted_mean_and_covariance():
+    rng = np.random.default_rng(0)
+    s = np.array([0.0, 0.0, 1.0]) + rng.normal(scale=0.01, size=(200, 3))
+    stats = StokesStats()
+    for x in s:
+        stats.add(x)
+    assert stats.n == 200
+    assert np.allclose(stats.mean, s.mean(axis=0)/np.linalg.norm(s.mean(axis=0)))
+    assert np.allclose(stats.cov, np.cov(s, rowvar=False))
+    assert np.isclose(stats.spread, np.sqrt(np.trace(np.cov(s, rowvar=False))))
+    assert np.isclose(stats.radius, stats.z*stats.spread/np.sqrt(200))
+
+
+def test_weights():
+    stats = StokesStats()
+    stats.add([1.0, 0.0, 0.0], 3.0)
+    stats.add([0.0, 1.0, 0.0], 1.0)
+    # ignored
+    stats.add([0.0, 0.0, 1.0], 0.0)
+    assert stats.n == 2
+    assert np.allclose(stats.mean, np.array([3.0, 1.0, 0.0])/np.sqrt(10))
+    assert np.isclose(stats.n_eff, 16/10)
+
+
+def test_radius_shrinks():
+    rng = np.random.default_rng(1)
+    stats = StokesStats()
+    stats.add([1.0, 0.0, 0.0])
+    assert stats.radius == float("inf")
+    radii = list()
+    for i in range(400):
+        stats.add(np.array([1.0, 0.0, 0.0]) + rng.normal(scale=0.01, size=3))
+        radii.append(stats.radius)
+    assert radii[-1] < radii[9]/3
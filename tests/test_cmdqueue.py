@@ -0,0 +1,62 @@
+import asyncio
+from polctl.cmdqueue import CommandQueue
+from polctl.constants import CMD, PRIO_PREEMPT
+
+
+def test_served_by_priority_then_order():
+    async def run():
+        q = CommandQueue()
+        for cmd in (CMD.CAPTURE, CMD.MEAS, CMD.SET, CMD.ABORT, CMD.MAINTAIN):
+            await q.put(cmd, None, cmd)
+        return [(await q.get())["cmd"] for _ in range(q.qsize())]
+
+    assert asyncio.run(run()) == [CMD.ABORT, CMD.SET, CMD.MAINTAIN, CMD.CAPTURE, CMD.MEAS]
+
+
+def test_duplicates_are_coalesced():
+    async def run():
+        q = CommandQueue()
+        await q.put(CMD.CAPTURE, ["10"], "a")
+        await q.put(CMD.CAPTURE, ["10"], "b")
+        await q.put(CMD.CAPTURE, ["20"], "c")
+        assert q.qsize() == 2
+        first = await q.get()
+        assert first["replies"] == ["a", "b"]
+        # once served, the same command queues anew
+        await q.put(CMD.CAPTURE, ["10"], "d")
+        assert q.qsize() == 2
+
+    asyncio.run(run())
+
+
+def test_take_and_drop():
+    async def run():
+        q = CommandQueue()
+        await q.put(CMD.SET, ["H", "0.99"], "a")
+        await q.put(CMD.SET, ["V", "0.99"], "b")
+        await q.put(CMD.CAPTURE, None, "c")
+        await q.put(CMD.MAINTAIN, ["H"], "d")
+        assert q.take(CMD.SET, ["H", "0.99"]) == ["a"]
+        assert q.take(CMD.SET, ["H", "0.99"]) == []
+        dropped = q.drop((CMD.SET, CMD.MAINTAIN))
+        assert sorted(e["cmd"] for e in dropped) == [CMD.MAINTAIN, CMD.SET]
+        assert q.qsize() == 1
+        assert (await q.get())["cmd"] == CMD.CAPTURE
+        assert q.empty()
+
+    asyncio.run(run())
+
+
+def test_wait_for_urgent_command():
+    async def run():
+        q = CommandQueue()
+        await q.put(CMD.CAPTURE, None, "a")
+        assert not q.pending(PRIO_PREEMPT)
+        waiter = asyncio.create_task(q.wait(PRIO_PREEMPT))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        await q.put(CMD.ABORT, None, "b")
+        await asyncio.wait_for(waiter, 1)
+        assert q.pending(PRIO_PREEMPT)
+
+    asyncio.run(run())
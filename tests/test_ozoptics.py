@@ -0,0 +1,69 @@
+import pytest
+import numpy as np
+from polctl import ozoptics
+from polctl.sim import SimBench, SimSerial
+from polctl.ozoptics import EPCDriver
+
+
+@pytest.fixture(autouse=True)
+def quick_queries(monkeypatch):
+    # the simulated EPC answers at once, queries end after a short silence
+    monkeypatch.setattr(ozoptics, "EPC_QUERY_TIMEOUT", 0.1)
+
+
+class FlakySerial(SimSerial):
+    # Fails the first command of each channel in fail
+    def __init__(self, bench, fail):
+        super().__init__(bench)
+        self.fail = set(fail)
+
+    def _handle(self, cmd):
+        ch = cmd[1:].split(",")[0] if cmd.startswith("V") else None
+        if ch in self.fail:
+            self.fail.discard(ch)
+            return b"Error\r\n"
+        return super()._handle(cmd)
+
+
+def test_pipelined_writes_are_acknowledged():
+    bench = SimBench(seed=0, tau=0)
+    epc = EPCDriver(ser=bench.serial())
+    try:
+        for i in range(50):
+            epc.write_vs([10*i, -10*i, 20*i, 5])
+        # a query waits for every pipelined write to be answered
+        assert epc.help == "Done\r\n"
+        assert not epc._pending
+        assert np.array_equal(bench.epc.voltages(), [490, -490, 980, 5])
+        # channel 4 was only sent once
+        assert epc.commands_sent == 1 + 3*50 + 1 + 1
+        assert epc.writes_skipped == 49
+    finally:
+        epc.close()
+
+
+def test_failed_write_is_sent_again():
+    bench = SimBench(seed=0, tau=0)
+    epc = EPCDriver(ser=FlakySerial(bench, fail=["2"]))
+    try:
+        epc.write_vs([100, 200, 300, 400])
+        epc.help
+        assert epc._sent == [100, None, 300, 400]
+        sent = epc.commands_sent
+        epc.write_vs([100, 200, 300, 400])
+        epc.help
+        assert epc.commands_sent == sent + 2
+        assert np.array_equal(bench.epc.voltages(), [100, 200, 300, 400])
+    finally:
+        epc.close()
+
+
+def test_voltages_are_clamped():
+    bench = SimBench(seed=0, tau=0)
+    epc = EPCDriver(ser=bench.serial())
+    try:
+        epc.write_vs({1: 1e6, 3: -1e6})
+        epc.help
+        assert np.array_equal(bench.epc.voltages(), [5000, 0, -5000, 0])
+    finally:
+        epc.close()
@@ -0,0 +1,59 @@
+import asyncio
+from polctl.protocol import read_lines
+
+
+async def _collect(reader, idle, feed):
+    lines = list()
+
+    async def consume():
+        async for line in read_lines(reader, idle):
+            lines.append(line)
+
+    task = asyncio.create_task(consume())
+    for data, pause in feed:
+        reader.feed_data(data)
+        await asyncio.sleep(pause)
+    reader.feed_eof()
+    await asyncio.wait_for(task, 1)
+    return lines
+
+
+def test_newline_terminated():
+    async def run():
+        return await _collect(asyncio.StreamReader(), 0.05,
+                              [(b"S H 0.99\nC", 0), (b" 10\nG\n", 0)])
+
+    assert asyncio.run(run()) == [b"S H 0.99", b"C 10", b"G"]
+
+
+def test_idle_completes_text_command():
+    async def run():
+        return await _collect(asyncio.StreamReader(), 0.05, [(b"C 10", 0.2), (b"G\n", 0)])
+
+    assert asyncio.run(run()) == [b"C 10", b"G"]
+
+
+def test_framed_modes_wait_for_the_newline():
+    async def run():
+        mode = {"text": True}
+        reader = asyncio.StreamReader()
+        lines = list()
+
+        async def consume():
+            async for line in read_lines(reader, lambda: 0.05 if mode["text"] else None):
+                lines.append(line)
+                mode["text"] = False
+
+        task = asyncio.create_task(consume())
+        reader.feed_data(b"PROTO JSON\n")
+        await asyncio.sleep(0.01)
+        reader.feed_data(b'{"id": 1, "cmd"')
+        await asyncio.sleep(0.2)
+        reader.feed_data(b': "G"}\n{"id": 2')
+        await asyncio.sleep(0.2)
+        # an unterminated request at the end of the stream is dropped
+        reader.feed_eof()
+        await asyncio.wait_for(task, 1)
+        return lines
+
+    assert asyncio.run(run()) == [b"PROTO JSON", b'{"id": 1, "cmd": "G"}']
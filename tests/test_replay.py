@@ -0,0 +1,54 @@
+import asyncio
+import logging
+import numpy as np
+from polctl.backends import open_devices
+from polctl.pol_ctl import PolarizationControl
+from polctl.replay import load_trace, settled_samples, TRACE_VOLTS, TRACE_MEAS, TRACE_COLS
+
+logging.disable(logging.INFO)
+
+
+def _row(t, kind, *values):
+    row = np.full(TRACE_COLS, np.nan)
+    row[0] = t
+    row[1] = kind
+    row[2:2+len(values)] = values
+    return row
+
+
+async def _calibrate(epc, pax, seed):
+    np.random.seed(seed)
+    pc = PolarizationControl(epc=epc, pax=pax, name=f"replay-{seed}")
+    pc.rng = np.random.default_rng(seed)
+    try:
+        p, f, n = await pc.gradient_ascent(target_states=[np.array([0.0, 1.0, 0.0])],
+                                           max_iterations=200, threshold=0.001)
+        return pc._evals, f[-1]
+    finally:
+        pc.epc_io.close()
+        pc.pax_io.close()
+
+
+def test_settled_samples_keep_last_reading_per_write():
+    rows = np.array([
+        _row(0.0, TRACE_MEAS, 0, 0, 0, 1, 1, 0),      # before any write
+        _row(1.0, TRACE_VOLTS, 1, 2, 3, 4),
+        _row(1.1, TRACE_MEAS, 2, 0.1, 0, 1, 1, 10),   # transient
+        _row(1.2, TRACE_MEAS, 4, 0.2, 0, 1, 1, 20),   # used
+        _row(2.0, TRACE_VOLTS, 5, 6, 7, 8),
+        _row(2.1, TRACE_MEAS, 6, 0.3, 0, 1, 1, 30),   # used
+    ])
+    t, v, s, dop, p = settled_samples(rows)
+    assert list(t) == [1.2, 2.1]
+    assert v.tolist() == [[1, 2, 3, 4], [5, 6, 7, 8]]
+
+
+def test_replay_reproduces_eval_count(tmp_path):
+    path = str(tmp_path / "trace.bin")
+    epc, pax = open_devices("sim", trace=path, seed=1, latency=0)
+    recorded = asyncio.run(_calibrate(epc, pax, seed=1))
+    epc.ser.recorder.close()
+    assert len(load_trace(path))
+    epc, pax = open_devices("replay", path=path, latency=0)
+    replayed = asyncio.run(_calibrate(epc, pax, seed=1))
+    assert replayed == recorded
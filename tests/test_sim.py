@@ -0,0 +1,48 @@
+import time
+import asyncio
+import logging
+import pytest
+import numpy as np
+from polctl.sim import SimBench
+from polctl.ozoptics import EPCDriver
+from polctl.pax1000 import PAX1000, Measurement
+from polctl.pol_ctl import PolarizationControl
+from polctl.sop import fidelity
+
+logging.disable(logging.INFO)
+
+
+def test_one_record_per_dataset():
+    bench = SimBench(seed=0, latency=0)
+    inst = bench.instrument()
+    a = Measurement(inst.query("SENS:DATA:LAT?"))
+    b = Measurement(inst.query("SENS:DATA:LAT?"))
+    assert a.fields == b.fields
+    assert a.revs % 2 == 0
+    time.sleep(3/bench.rev_rate)
+    c = Measurement(inst.query("SENS:DATA:LAT?"))
+    assert c.revs % 2 == 0 and c.revs > a.revs
+    assert c.timestamp > a.timestamp
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_calibration_converges(seed):
+    async def run():
+        np.random.seed(seed)
+        bench = SimBench(seed=seed, latency=0)
+        pc = PolarizationControl(epc=EPCDriver(ser=bench.serial()),
+                                 pax=PAX1000(inst=bench.instrument()), name=f"sim-{seed}")
+        pc.rng = np.random.default_rng(seed)
+        target = np.array([0.0, 0.0, 1.0])
+        try:
+            p, f, n = await pc.gradient_ascent(target_states=[target], max_iterations=200,
+                                               threshold=0.001)
+            await asyncio.sleep(0.1)
+            return f[-1], fidelity(bench.sop(), [target])
+        finally:
+            pc.epc_io.close()
+            pc.pax_io.close()
+
+    measured, true = asyncio.run(run())
+    assert measured >= 0.999
+    assert np.all(true >= 0.99)